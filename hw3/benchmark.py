@@ -0,0 +1,196 @@
+'''
+Microbenchmarks for the GoodCoin hot paths.
+
+Run "python3 benchmark.py <name>" from the goodcoin root folder, e.g. "python3 benchmark.py pow".
+Run it without arguments to go through all of them.
+'''
+from argparse import ArgumentParser
+from time import time
+import json
+import random
+
+from blockchain import Blockchain
+from block import Block
+from message import Message
+from utxo import UTXOSet
+from proof import ProofChecker
+import verify
+import wire
+from tests.synthetic import reference_consensus, synthetic_chains, synthetic_network
+
+
+def report(name, count, seconds, unit):
+    print('%-40s %12.0f %s/sec' % (name, count / seconds, unit))
+
+
+def bench_pow(guesses=200000):
+    '''
+    Proof of work guesses/sec: the plain valid_proof rule against the midstate ProofChecker.
+    '''
+    last_proof, last_hash = 35293, Blockchain.hash({'index': 1, 'proof': 35293})
+
+    start = time()
+    for proof in range(guesses):
+        Blockchain.valid_proof(last_proof, proof, last_hash)
+    report('valid_proof', guesses, time() - start, 'guesses')
+
+    # Use a target nobody can hit so the search goes through the whole range.
+    checker = ProofChecker(last_proof, last_hash, difficulty=64)
+    start = time()
+    checker.search(0, guesses)
+    report('ProofChecker.search', guesses, time() - start, 'guesses')
+
+
+def bench_verify(addresses=20, txs=2000):
+    '''
+    Signature verifications/sec with a cold and a warm verifying key cache.
+    The signature cache is bypassed so every transaction is really verified.
+    '''
+    bc = Blockchain()
+    keys = [bc.generate_keypair(to_str=False) for _ in range(addresses)]
+    batch = []
+    for i in range(txs):
+        sk, vk = keys[i % addresses]
+        tx = {'ins': [{'tx_hash': str(i), 'output_index': 0, 'amount': 1, 'addr': Blockchain.key_to_addr(vk)}],
+              'outs': [{'amount': 1, 'addr': 'someone'}], 'time': i, 'coinbase': False}
+        tx['hash'] = Blockchain.hash(tx)
+        batch.append(bc.sign_tx(tx, sk))
+
+    start = time()
+    for tx in batch:
+        verify.key_cache.clear()
+        assert verify.check_signature(tx)
+    report('cold key cache', txs, time() - start, 'verifications')
+
+    for sk, vk in keys:
+        for _ in range(verify.key_cache.hot_after):
+            verify.addr_to_vk(Blockchain.key_to_addr(vk))
+    start = time()
+    for tx in batch:
+        assert verify.check_signature(tx)
+    report('warm key cache (precomputed)', txs, time() - start, 'verifications')
+
+
+def bench_consensus(peers=(10, 50), lengths=(100, 1000, 10000), byzantine=(0.3, 0.5)):
+    '''
+    Time of Blockchain.consensus as peers and chains grow, against the original algorithm while it is still bearable.
+    With half of the peers byzantine the majority prefix ends at their fork point, deep in the chains.
+    '''
+    bc = Blockchain()
+    for fraction in byzantine:
+        for n in peers:
+            for length in lengths:
+                chains, _ = synthetic_chains(n, length, byzantine=fraction, seed=length)
+                name = '%d peers x %d, %d%% byzantine' % (n, length, fraction * 100)
+                start = time()
+                winner = bc.consensus(chains)
+                print('%-50s %10.4f sec' % ('consensus, ' + name, time() - start))
+                if length <= 1000:
+                    start = time()
+                    assert reference_consensus(chains) == winner
+                    print('%-50s %10.4f sec' % ('reference, ' + name, time() - start))
+
+
+def bench_resolve(peers=(5, 20), lengths=(50, 200), byzantine=0.3):
+    '''
+    Time of a whole resolve_conflicts against in-process peers, building the network isn't counted.
+    '''
+    for n in peers:
+        for length in lengths:
+            us, _ = synthetic_network(n, length, byzantine=byzantine, seed=length)
+            start = time()
+            assert us.resolve_conflicts()
+            print('%-50s %10.4f sec' % ('resolve_conflicts, %d peers x %d' % (n, length), time() - start))
+
+
+def signed_blocks(blocks=100, txs_per_block=5, addresses=20):
+    '''
+    Blocks full of signed payments between a few addresses, like the ones peers exchange.
+    '''
+    bc = Blockchain()
+    keys = [bc.generate_keypair(to_str=False) for _ in range(addresses)]
+    chain = []
+    for b in range(blocks):
+        txs = []
+        for t in range(txs_per_block):
+            sk, vk = keys[(b + t) % addresses]
+            tx = {'ins': [{'tx_hash': '%064x' % random.getrandbits(256), 'output_index': 0, 'amount': 2,
+                           'addr': Blockchain.key_to_addr(vk)}],
+                  'outs': [{'amount': 2, 'addr': Blockchain.key_to_addr(keys[t % addresses][1])}],
+                  'time': time(), 'coinbase': False}
+            tx['hash'] = Blockchain.hash(tx)
+            txs.append(bc.sign_tx(tx, sk))
+        chain.append(Block({'index': b + 1, 'timestamp': time(), 'transactions': txs, 'proof': random.getrandbits(20),
+                            'previous_hash': Blockchain.hash(chain[-1]) if chain else '1'}))
+    return chain
+
+
+def bench_wire(blocks=100):
+    '''
+    Size and encoding/decoding speed of a /jchain response in JSON and in the wire format.
+    '''
+    chain = signed_blocks(blocks)
+    response = {'chain': chain, 'hashes': [block.digest for block in chain], 'length': len(chain), 'start': 0}
+    for name, dumps, loads in [('json', lambda x: json.dumps(x).encode(), json.loads), ('wire', wire.dumps, wire.loads)]:
+        start = time()
+        data = dumps(response)
+        encoded = time() - start
+        start = time()
+        decoded = loads(data)
+        decoded_in = time() - start
+        assert [Blockchain.hash(block) for block in decoded['chain']] == response['hashes']
+        print('%-40s %10d bytes' % ('%s size' % name, len(data)))
+        report('%s encoding' % name, blocks, encoded, 'blocks')
+        report('%s decoding' % name, blocks, decoded_in, 'blocks')
+
+
+def bench_gossip(txs=1000, relays=3, workers=4):
+    '''
+    NEW_TX messages/sec through the message queue: every transaction arrives from `relays` peers,
+    processed one message at a time and then in batches.
+    '''
+    sender = Blockchain()
+    keys = [sender.generate_keypair(to_str=False) for _ in range(20)]
+    utxos, msgs = [], []
+    for i in range(txs):
+        sk, vk = keys[i % len(keys)]
+        utxo = {'tx_hash': '%064x' % i, 'output_index': 0, 'amount': 1, 'addr': Blockchain.key_to_addr(vk)}
+        tx = {'ins': [utxo], 'outs': [{'amount': 1, 'addr': 'someone'}], 'time': time(), 'coinbase': False}
+        tx['hash'] = Blockchain.hash(tx)
+        utxos.append(utxo)
+        msgs.append(Message.to_str('127.0.0.1:5000', Message.NEW_TX, json.dumps(sender.sign_tx(tx, sk))))
+
+    for name, batch, pool in [('one at a time', 1, 0), ('batches of 64', 64, 0), ('batches of 64, %d workers' % workers, 64, workers)]:
+        node = Blockchain()
+        node.utxo_pool = UTXOSet(utxos)
+        node.mqueue_batch = batch
+        node.verifier.workers = pool
+        node.verifier.start() # doesn't count starting the pool
+        verify.key_cache.clear()
+        for msg in msgs * relays:
+            node.push_message(msg)
+        start = time()
+        node.process_mqueue()
+        report(name, txs * relays, time() - start, 'messages')
+        assert len(node.current_transactions) == txs
+        node.verifier.stop()
+
+
+BENCHMARKS = {
+    'gossip': bench_gossip,
+    'consensus': bench_consensus,
+    'pow': bench_pow,
+    'resolve': bench_resolve,
+    'verify': bench_verify,
+    'wire': bench_wire,
+}
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('names', nargs='*', help='Benchmarks to run, any of %s (default: all)' % ', '.join(sorted(BENCHMARKS)))
+    args = parser.parse_args()
+    for name in args.names or sorted(BENCHMARKS):
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark %s' % name)
+        print('===== %s =====' % name)
+        BENCHMARKS[name]()
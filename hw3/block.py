@@ -0,0 +1,55 @@
+import hashlib
+import json
+
+
+class Block(dict):
+    '''
+    A Block of the chain together with its canonical encoding and hash.
+
+    Blocks are plain dicts everywhere (jsonify, templates, peers), but Blockchain.hash used to
+    re-serialise the whole block with json.dumps on every call. A Block computes the encoding and
+    the hash once, when it is created or received, and can't be modified afterwards so the cached
+    values stay right.
+    '''
+
+    def __init__(self, fields, digest=None, verify=True):
+        '''
+        :param fields: <dict> {index, timestamp, transactions, proof, previous_hash}
+        :param digest: <str> (Optional) Hash that came with the block, e.g. from a peer.
+        :param verify: <bool> Check digest against the block content instead of trusting it.
+        '''
+        dict.__init__(self, fields)
+        self._encoding = None
+        if digest is None or verify:
+            computed = hashlib.sha256(self.encoding).hexdigest()
+            if digest is not None and digest != computed:
+                raise ValueError('Block %s has hash %s, expected %s' % (self.get('index'), computed, digest))
+            digest = computed
+        self.digest = digest
+
+    @classmethod
+    def from_encoding(cls, encoding, digest=None):
+        '''
+        Block back from its encoding, e.g. as read from the block store. The encoding is kept as it is.
+        :param digest: <str> (Optional) Known hash of the block, trusted without checking.
+        '''
+        encoding = bytes(encoding)
+        block = cls(json.loads(encoding), digest or hashlib.sha256(encoding).hexdigest(), verify=False)
+        block._encoding = encoding
+        return block
+
+    @property
+    def encoding(self):
+        # json.dumps(sort_keys=True) is the encoding Blockchain.hash has always used.
+        if self._encoding is None:
+            self._encoding = json.dumps(self, sort_keys=True).encode()
+        return self._encoding
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('Block is immutable')
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return (Block, (dict(self), self.digest, False))
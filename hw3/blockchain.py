@@ -3,13 +3,21 @@ import json
 import requests
 import logging
 import base58
-from ecdsa import SigningKey, VerifyingKey
-from threading import Lock, Thread
+from ecdsa import SigningKey
+from threading import Lock, RLock, Thread
 from time import time, sleep
 from urllib.parse import urlparse
 from uuid import uuid4
 from message import Message
-from collections import defaultdict
+from block import Block
+from utxo import UTXOSet
+from verify import SignatureVerifier
+import verify
+from proof import ProofChecker
+import wire
+from collections import defaultdict, deque, OrderedDict
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor, wait
 import copy
 
 logging.basicConfig(level=logging.INFO)
@@ -31,25 +39,49 @@ Notes on bad nodes:
 class Blockchain(object):
     def __init__(self):
         self.chain = []
-        self.mqueue = [] #the message queue which contains msg from other node
-        self.mqueue_mutex = Lock()
+        self.chain_mutex = RLock() # guards chain, current_transactions and utxo_pool together.
+        self.tip_generation = 0 # bumped every time the last block changes, lets mining notice a stale parent.
+        self.mqueue = Queue() #the message queue which contains (msg, time received) from other nodes
+        self.mqueue_latency = deque(maxlen=1000) # seconds each of the last messages waited before being processed.
+        self.mqueue_processed = 0
+        self.mqueue_max_depth = 0
+        self.mqueue_batch = 64 # most messages processed together.
+        self.seen_txs = OrderedDict() # hashes of the transactions we have announced, accepted or are fetching, oldest first.
+        self.seen_size = 100000
+        self.gossip_counts = defaultdict(int) # inv/tx/block counters reported by mqueue_stats.
+        self.resolve_mutex = Lock() # held by the resolution receive_block falls back to, one at a time.
+        self.short_id_length = 12 # hex digits of the transaction hashes sent in compact blocks.
+        self.consumer = None # thread processing messages as they arrive, see start_consumer.
         self.current_transactions = []
         self.transactions_per_block = 5
         self.nodes = set()
         self.nodes_mutex = Lock()
         self.reward = 2 # 2 GoodCoins mined per block.
         self.address = ""
-        self.utxo_pool = []
+        self.utxo_pool = UTXOSet()
         self.sk, self.vk = self.generate_keypair()
         self.good = True # Boolean controlling benign/malicious node behavior.
+        self.verify_blocks = True # Recompute the hash of blocks received from peers instead of trusting theirs.
+        self.verified_blocks = {} # hash -> height of every block whose proof of work we have checked (or mined).
+        self.block_undo = {} # hash -> UTXOs spent by each transaction of the block, to roll it back.
+        self.peer_timeout = 5 # seconds, for each request to a peer.
+        self.resolve_deadline = 10 # seconds, for fetching from all peers during resolve_conflicts.
+        self.max_fetch_threads = 16
+        self.wire_format = False # Ask peers for blocks and headers in the compact binary format, see wire.py.
+        self.miner = None # Optional proof of work engine, see miner.py.
+        self.msgr = None # Messenger used for gossip, see set_msgr.
+        self.store = None # Optional on-disk BlockStore, see set_store.
+        self.verifier = SignatureVerifier()
+        self.hashrate = 0 # hashes/sec of the last proof of work search.
 
     def start(self):
         # Create the genesis Block or sync with other nodes
-        if len(self.nodes) == 0:
+        # A chain loaded from the block store only has to catch up with them.
+        if len(self.nodes) > 0:
+            self.resolve_conflicts()
+        elif len(self.chain) == 0:
             self.new_transaction([],[], None, coinbase=True)
             self.new_block(previous_hash='1', proof=100)
-        else:
-            self.resolve_conflicts()
 
     def genesis(self):
         self.new_transaction([],[], None, coinbase=True)
@@ -57,7 +89,14 @@ class Blockchain(object):
 
     ############################## MINING FUNCTIONS ##############################
 
-    def proof_of_work(self, last_block):
+    def set_miner(self, miner):
+        '''
+        Plug in a proof of work engine (e.g. miner.ParallelMiner) used by proof_of_work.
+        Passing None goes back to the built-in single threaded search.
+        '''
+        self.miner = miner
+
+    def proof_of_work(self, last_block, generation=None, should_stop=None):
         """
         Simple Proof of Work Algorithm:
          - Find a number p' such that hash(pp') contains leading 4 zeroes
@@ -65,16 +104,31 @@ class Blockchain(object):
          - For the purposes of this assignment, p' = counter + last_hash
 
         :param last_block: <dict> last Block
-        :return: <int>
+        :param generation: <int> (Optional) tip_generation last_block was read at.
+        If given, the search gives up as soon as the chain tip changes.
+        :param should_stop: <callable> (Optional) Any other reason to give up, polled during the search.
+        :return: <int> or None if the search was abandoned
         """
 
         last_proof = last_block['proof']
         last_hash = self.hash(last_block)
 
-        proof = 0
-        while self.valid_proof(last_proof, proof, last_hash) is False:
-            proof += 1
-
+        stop_checks = [f for f in [should_stop] if f is not None]
+        if generation is not None:
+            stop_checks.append(lambda: self.tip_generation != generation)
+        should_stop = (lambda: any(f() for f in stop_checks)) if stop_checks else None
+
+        if self.miner is not None:
+            proof = self.miner.search(last_proof, last_hash, should_stop)
+            self.hashrate = self.miner.hashrate
+            return proof
+
+        # Same rule as valid_proof, just faster (see proof.py).
+        start = time()
+        checker = ProofChecker(last_proof, last_hash)
+        proof = checker.search(0, should_stop=should_stop)
+        elapsed = time() - start
+        self.hashrate = checker.hashes / elapsed if elapsed > 0 else 0
         return proof
 
     @staticmethod
@@ -90,30 +144,52 @@ class Blockchain(object):
         return guess_hash[:4] == "0000"
 
 
-    def mine(self):
+    def mine(self, restart=True, should_stop=None):
         """
         Compute the proof, append a final transaction
         and mine a new Block in the chain
+
+        If resolve_conflicts replaces the chain while we are searching, the proof of work
+        is abandoned rather than finished on an orphaned parent.
+        :param restart: <bool> Start over on the new tip (True) or give up (False) when that happens.
+        :param should_stop: <callable> (Optional) Lets the caller abandon mining altogether.
+        :return: <dict> New Block, or None if mining was abandoned
+        """
+        while True:
+            # We run the proof of work algorithm to get the next proof...
+            with self.chain_mutex:
+                last_block = self.last_block
+                generation = self.tip_generation
+            proof = self.proof_of_work(last_block, generation, should_stop)
+
+            with self.chain_mutex:
+                if proof is not None and generation == self.tip_generation:
+                    return self.forge_block(proof, last_block)
+            if should_stop is not None and should_stop():
+                return None
+            if not restart:
+                logging.info("Chain tip changed while mining, giving up")
+                return None
+            logging.info("Chain tip changed while mining, restarting on the new tip")
+
+    def forge_block(self, proof, last_block):
+        """
+        Add the coinbase and the new Block on top of last_block once its proof has been found.
+        :param proof: <int> Proof found for the new Block
+        :param last_block: <dict> Parent of the new Block, must still be the last block.
         :return: <dict> New Block
         """
-        # We run the proof of work algorithm to get the next proof...
-        last_block = self.last_block
-        proof = self.proof_of_work(last_block)
-
         # Generate coinbase transaction.
         coinbase = self.new_transaction([],[], None, coinbase=True)
 
-        # Since we have a new block, trigger peers to
-        # resolve potential chain conflicts
-        # No need to send any message, since we already ask peers to resolve.
-        thr = Thread(target=self.force_resolve)
-        thr.daemon = True
-        thr.start()
-
         # Forge the new Block by adding it to the chain
         previous_hash = self.hash(last_block)
 
-        return self.new_block(proof, previous_hash)
+        block = self.new_block(proof, previous_hash)
+        # Peers append it when they get it (see receive_block), instead of all of them resolving.
+        if isinstance(block, Block):
+            self.announce_block(block)
+        return block
 
     def new_block(self, proof, previous_hash):
         """
@@ -122,22 +198,26 @@ class Blockchain(object):
         :param previous_hash: (Optional) <str> Hash of previous Block
         :return: <dict> New Block
         """
-        block = {
+        # Check for signature validity.
+        if not all(self.verifier.verify_many(self.current_transactions[1:])):
+            return 'Found invalid transaction in block.'
+
+        block = Block({
             'index': len(self.chain) + 1,
             'timestamp': time(),
-            'transactions': self.current_transactions,
+            'transactions': list(self.current_transactions),
             'proof': proof,
             'previous_hash': previous_hash or self.hash(self.chain[-1]),
-        }
-
-        # Check for signature validity.
-        for tx in self.current_transactions[1:]:
-            if not self.verify_signature(tx):
-                return 'Found invalid transaction in block.'
+        })
 
         # Reset the current list of transactions
         self.current_transactions = []
         self.chain.append(block)
+        self.verified_blocks[block.digest] = len(self.chain) - 1
+        # Its transactions went through the UTXO pool when they entered the mempool.
+        self.block_undo[block.digest] = [tx['ins'] for tx in block['transactions']]
+        self.tip_generation += 1
+        self.store_blocks(len(self.chain) - 1, [block])
         logging.debug(self.chain)
         return block
 
@@ -165,30 +245,34 @@ class Blockchain(object):
                   'outs': [o for o in outs],
                   'time': time(), # Basically a nonce so you don't get the same transaction twice.
                   'coinbase': False }
-        if self.valid_tx(tx) != True:
-            # Return the error code.
-            return self.valid_tx(tx)
-        # If it's valid, add the hash and put it in the current_txs pool.
-        tx['hash'] = self.hash(tx)
-        if coinbase:
-            # Node will sign coinbase transaction with its own secret key.
-            # Can't verify this because there's no associated public key to check.
-            tx = self.sign_tx(tx, SigningKey.from_string(self.sk))
-            self.current_transactions = [tx] + self.current_transactions
-        else:
-            if type(sk) is str:
-                # assume base58 encoding here.
-                sk = self.decode_sk(sk)
-            elif type(sk) is bytes:
-                # assume bytestring here.
-                sk = SigningKey.from_string(sk)
-            tx = self.sign_tx(tx, sk)
-            if not self.verify_signature(tx):
-                return 'Signature not valid.', 400
-            self.current_transactions.append(tx)
-
-        self.msgr.publish_message(Message.NEW_TX, json.dumps(tx))
-        self.update_utxo_pool(tx)
+        # The mining thread copies then empties the mempool under chain_mutex (see new_block). A transaction
+        # added in between would be lost while its inputs stay spent in the pool.
+        with self.chain_mutex:
+            if self.valid_tx(tx) != True:
+                # Return the error code.
+                return self.valid_tx(tx)
+            # If it's valid, add the hash and put it in the current_txs pool.
+            tx['hash'] = self.hash(tx)
+            if coinbase:
+                # Node will sign coinbase transaction with its own secret key.
+                # Can't verify this because there's no associated public key to check.
+                tx = self.sign_tx(tx, SigningKey.from_string(self.sk))
+                self.current_transactions = [tx] + self.current_transactions
+            else:
+                if type(sk) is str:
+                    # assume base58 encoding here.
+                    sk = self.decode_sk(sk)
+                elif type(sk) is bytes:
+                    # assume bytestring here.
+                    sk = SigningKey.from_string(sk)
+                tx = self.sign_tx(tx, sk)
+                if not self.verify_signature(tx):
+                    return 'Signature not valid.', 400
+                self.current_transactions.append(tx)
+            self.update_utxo_pool(tx)
+
+        if self.msgr is not None and not coinbase:
+            self.announce_txs([tx])
 
         if len(self.chain) == 0:
             return 0
@@ -223,6 +307,9 @@ class Blockchain(object):
                 return "Must provide transaction outputs.", 400
             elif not all(elem in self.utxo_pool for elem in tx['ins']):
                 return "Inputs not found in UTXO pool.", 400
+            elif len(set((i['tx_hash'], i['output_index']) for i in tx['ins'])) != len(tx['ins']):
+                # The same output listed twice would be counted twice in the sum below.
+                return "Transaction inputs must be distinct.", 400
             elif sum([el['amount'] for el in tx['ins']]) != sum([el['amount'] for el in tx['outs']]):
                 return "Sum of inputs does not equal sum of outputs.", 400
             elif len(list(set([el['addr'] for el in tx['ins']]))) != 1:
@@ -232,6 +319,21 @@ class Blockchain(object):
                 return "Transaction timestamp is incorrect.", 400
             return True
 
+    @staticmethod
+    def well_formed_tx(tx):
+        '''
+        Check that a transaction from a peer has the fields verification and valid_tx read, with usable types,
+        so a malformed one is dropped rather than raising in the middle of a batch.
+        '''
+        number = lambda x: isinstance(x, (int, float)) and not isinstance(x, bool)
+        return (isinstance(tx, dict)
+                and isinstance(tx.get('hash'), str) and isinstance(tx.get('sig'), str)
+                and isinstance(tx.get('coinbase'), bool) and number(tx.get('time'))
+                and isinstance(tx.get('ins'), list) and isinstance(tx.get('outs'), list)
+                and all(isinstance(i, dict) and isinstance(i.get('tx_hash'), str) and isinstance(i.get('output_index'), int)
+                        and number(i.get('amount')) and isinstance(i.get('addr'), str) for i in tx['ins'])
+                and all(isinstance(o, dict) and number(o.get('amount')) and isinstance(o.get('addr'), str) for o in tx['outs']))
+
     def update_utxo_pool(self, tx):
         """
         Updates UTXO pool based on single transaction.
@@ -239,9 +341,9 @@ class Blockchain(object):
         """
         if not tx['coinbase']:
             for i in tx['ins']:
-                self.utxo_pool.remove(i)
+                self.utxo_pool.spend(i)
         for ix, o in enumerate(tx['outs']):
-            self.utxo_pool.append({'tx_hash':tx['hash'], 'output_index':ix, 'amount':o['amount'], 'addr': o['addr']})
+            self.utxo_pool.add({'tx_hash':tx['hash'], 'output_index':ix, 'amount':o['amount'], 'addr': o['addr']})
         return True
 
 
@@ -260,11 +362,9 @@ class Blockchain(object):
         '''
         Check that the transaction signature is valid using the public key from tranaction inputs.
         return True for valid signature else False
+        Results are cached, see verify.py.
         '''
-        if tx['coinbase'] == True: return True
-        sig = base58.b58decode(bytes(tx['sig'], 'utf-8'))
-        vk = self.addr_to_vk(tx['ins'][0]['addr']) # again, assume all input addresses are the same.
-        return vk.verify(sig, bytes(tx['hash'], 'utf-8')) # will return false if the signature doesn't verify.
+        return self.verifier.verify(tx)
 
 
     @staticmethod
@@ -297,7 +397,7 @@ class Blockchain(object):
         '''
         Convert an address back into a verifying key format so you can verify a signature.
         '''
-        return VerifyingKey.from_string(base58.b58decode(bytes(addr, 'utf-8')))
+        return verify.addr_to_vk(addr)
 
     @staticmethod
     def decode_sk(enc):
@@ -314,11 +414,14 @@ class Blockchain(object):
     def valid_chain(self, chain):
         """
         Determine if a given blockchain is valid
+
+        Blocks already verified at the same height (see verified_blocks) and linked to each other are
+        skipped, so validation starts at the fork point with our chain instead of at genesis.
         :param chain: <list> A blockchain
         :return: <bool> True if valid, False if not
         """
-        last_block = chain[0]
-        current_index = 1
+        current_index = self.verified_prefix(chain)
+        last_block = chain[current_index - 1]
 
         while current_index < len(chain):
             block = chain[current_index]
@@ -337,8 +440,137 @@ class Blockchain(object):
             last_block = block
             current_index += 1
 
+        for index, block in enumerate(chain):
+            self.verified_blocks[self.hash(block)] = index
         return True
 
+    def verified_prefix(self, chain):
+        '''
+        Length of the leading part of chain that is made of blocks we have already verified.
+        Always at least 1, the genesis block is not checked.
+        '''
+        length = 1
+        while (length < len(chain)
+               and self.verified_blocks.get(self.hash(chain[length])) == length
+               and chain[length]['previous_hash'] == self.hash(chain[length - 1])):
+            length += 1
+        return length
+
+    def load_chain(self, data):
+        '''
+        Turn a /jchain response into a list of Blocks, checking the hashes the peer sent
+        along unless verify_blocks is off.
+        :param data: <dict> {chain, hashes (optional)}
+        :return: <list> Blocks
+        '''
+        hashes = data.get('hashes')
+        if hashes is None or len(hashes) != len(data['chain']):
+            hashes = [None] * len(data['chain'])
+        return [Block(b, digest=h, verify=self.verify_blocks) for b, h in zip(data['chain'], hashes)]
+
+    @staticmethod
+    def header(block):
+        '''
+        Compact header of a block: everything needed to check its proof of work and links, but not its transactions.
+        '''
+        return {'index': block['index'],
+                'timestamp': block['timestamp'],
+                'proof': block['proof'],
+                'previous_hash': block['previous_hash'],
+                'hash': Blockchain.hash(block),
+                'num_txs': len(block['transactions'])}
+
+    def chain_position(self, block_hash):
+        '''
+        Position of the block with this hash in our chain, or None if it isn't in it.
+        '''
+        position = self.verified_blocks.get(block_hash)
+        chain = self.chain
+        if position is not None and position < len(chain) and self.hash(chain[position]) == block_hash:
+            return position
+        return None
+
+    def block_locator(self):
+        '''
+        Hashes of some of our blocks, newest first: the last 10 one by one, then exponentially
+        further apart down to genesis. The first one a peer knows is where our chains fork.
+        '''
+        chain = self.chain
+        positions = []
+        position, step = len(chain) - 1, 1
+        while position > 0:
+            positions.append(position)
+            if len(positions) >= 10: step *= 2
+            position -= step
+        if len(chain) > 0:
+            positions.append(0)
+        return [self.hash(chain[p]) for p in positions]
+
+    def get_headers(self, locator):
+        '''
+        Headers of our chain after the first block of the locator we have.
+        :param locator: <list> Block hashes, see block_locator.
+        :return: <tuple> (start, headers) where start is the position of the first header in our chain.
+        '''
+        start = 0
+        for block_hash in locator:
+            position = self.chain_position(block_hash)
+            if position is not None:
+                start = position + 1
+                break
+        return start, [self.header(block) for block in self.chain[start:]]
+
+    def get_blocks(self, after=None):
+        '''
+        Blocks of our chain that come after the block with hash `after`.
+        :return: <tuple> (start, blocks) where start is the position of the first block, or None if we don't have `after`.
+        '''
+        chain = self.chain
+        if after is None:
+            return 0, chain
+        position = self.chain_position(after)
+        if position is None:
+            return None
+        return position + 1, chain[position + 1:]
+
+    def raw_blocks(self, start=0, end=None):
+        '''
+        Encodings and hashes of our blocks from position start to end (excluded), to send them without
+        encoding them again: read from the block store if we have one, else cached by the Blocks.
+        :return: <tuple> (list of encodings, list of hashes, length of our chain)
+        '''
+        with self.chain_mutex:
+            if self.store is not None and self.store.height == len(self.chain):
+                encodings, hashes = self.store.read(start, end)
+                return encodings, hashes, len(self.chain)
+            blocks = self.chain[start:end]
+            return [block.encoding for block in blocks], [block.digest for block in blocks], len(self.chain)
+
+    def header_hash_list(self, chain, hash_list, start, headers):
+        '''
+        Check a peer's headers (links and proofs of work) and build the hash list of its chain.
+        :param chain: <list> Our chain, the first start blocks are shared with the peer.
+        :param hash_list: <list> get_hash_list(chain)
+        :param start: <int> Position of the first header in the peer's chain.
+        :param headers: <list> Headers of the peer's chain from start on.
+        :return: <list> Hash list of the peer's chain, or None if the headers are invalid.
+        '''
+        if start > len(chain) or (start == 0 and len(headers) == 0):
+            return None
+        if len(headers) == 0:
+            return hash_list[:start + 1]
+        last_proof = last_hash = None
+        if start > 0:
+            last_proof, last_hash = chain[start - 1]['proof'], self.hash(chain[start - 1])
+        for header in headers:
+            if last_hash is not None:
+                if header['previous_hash'] != last_hash:
+                    return None
+                if not self.valid_proof(last_proof, header['proof'], header['previous_hash']):
+                    return None
+            last_proof, last_hash = header['proof'], header['hash']
+        return hash_list[:start] + [headers[0]['previous_hash']] + [header['hash'] for header in headers]
+
     def get_hash_list(self, chain):
         #return a list of hashes, each hash represent a block in the chain
         l = []
@@ -360,39 +592,48 @@ class Blockchain(object):
         # Following code is an implementation of the 'longest chain w/ longest common prefix' policy
         # Note: in the classic longest common prefix problem setting, the common prefix needs to be shared by all chains
         #
-        # But in this problem, a common prefix is a prefix that is shared by at least 2 chains
-        # We first check the frequence of prefixes to find the longest common prefix
+        # But in this problem, a common prefix is a prefix that is shared by more than half of the chains
+        # We first find the longest such prefix
         # Then we find the longest chain containing the longest prefix
         # This consensus algorithm is vulnerable to selfish mining attack, please fix it as part of HW3.
-        prefix_counter = defaultdict(int)
+        #
+        # All the chains go into a trie of hashes where every node counts the chains going through it,
+        # i.e. the chains sharing that prefix, so the whole thing is O(total number of hashes).
         max_length = max([len(x) for x in chains.values()])
 
         chain_length = {k:len(v) for k,v in chains.items()}
         max_url = max(chain_length, key = chain_length.get)
         if max_length <= 2: return max_url
 
-        for length in reversed(range(1, max_length+1)):
-            is_common = False
-            for chain in chains.values():
-                if len(chain) < length: continue
-                else:
-                    prefix = ','.join(chain[:length])
-                    prefix_counter[prefix] += 1
-                    if prefix_counter[prefix] > (len(chains) / 2): is_common = True
-            if is_common: break
-            else: prefix_counter.clear()
-
-        # Now prefix_counter contains all longest common prefixes
-        # we went thru each of them and find out the longest chain with any of these prefixes
+        majority = len(chains) / 2
+        root = {} # hash -> [number of chains with this prefix, children]
+        paths = {} # url -> trie nodes along its chain
+        for url, chain in chains.items():
+            children, path = root, []
+            for h in chain:
+                node = children.get(h)
+                if node is None:
+                    node = children[h] = [0, {}]
+                node[0] += 1
+                path.append(node)
+                children = node[1]
+            paths[url] = path
+
+        # Deepest prefix shared by a majority of the chains.
+        # Counts only go down along a path, so each chain is scanned from its end until the depth found so far.
+        prefix_length, prefix_node = 0, None
+        for path in paths.values():
+            for length in range(len(path), prefix_length, -1):
+                if path[length - 1][0] > majority:
+                    prefix_length, prefix_node = length, path[length - 1]
+                    break
+        if prefix_node is None: return ''
+
+        # Now find the longest chain with that prefix (the first one in case of a tie)
         result = (0, '') #save the result into a tuple
-        for prefix in prefix_counter:
-            if prefix_counter[prefix] > (len(chains) / 2):
-                for url, chain in chains.items():
-                    if ','.join(chain).startswith(prefix) and result[0] < len(chain):
-                        result = (len(chain), url)
-        # print('=======PREFIX COUNTER=========')
-        # print(prefix_counter)
-        # print('==============================')
+        for url, path in paths.items():
+            if len(path) >= prefix_length and path[prefix_length - 1] is prefix_node and result[0] < len(path):
+                result = (len(path), url)
         # max's new consensus algorithm
         # max_count = 0
         # max_len = 0
@@ -422,45 +663,122 @@ class Blockchain(object):
         """
         This is our consensus algorithm, it resolves conflicts
         by replacing our chain with the longest one in the network.
+        Consensus runs on block headers (see get_headers), full blocks are only downloaded
+        for the part of the winning chain we don't have.
         :return: True if our chain was replaced, False if not
         """
         if len(self.nodes) == 0: return
+        generation = self.tip_generation
+        our_chain = list(self.chain)
+        our_hashes = self.get_hash_list(our_chain)
         hash_chains = {}
-        hash_chains[self.address] = self.get_hash_list(self.chain)
-        full_chains = {}
-        full_chains[self.address] = self.chain
+        hash_chains[self.address] = our_hashes
+        fork_points = {}
 
         neighbours = copy.deepcopy(self.nodes) #this is to avoid self.nodes change during iteration
-        # Grab and verify the chains from all the nodes in our network
-        peers = (node for node in neighbours if node != self.address)
-        for node in peers:
+        # Grab and verify the headers from all the nodes in our network
+        peers = [node for node in neighbours if node != self.address]
+        for node, (peer_good, start, headers) in self.fetch_peers(peers, self.fetch_headers).items():
             try:
-                # Query for node's "goodness status"
-                peer_good = requests.get(f"http://{node}/good").json()['good']
-                response = requests.get(f"http://{node}/jchain")
-                if response.status_code == 200:
-                    length = response.json()['length']
-                    chain = response.json()['chain']
-                    # Check if the length is longer and the chain is valid
-                    # Bad nodes only communicate with bad nodes and vice versa.
-                    if len(chain) > 0 and self.valid_chain(chain) and (self.good == peer_good):
-                        full_chains[node] = chain
-                        hash_chains[node] = self.get_hash_list(chain)
+                # Bad nodes only communicate with bad nodes and vice versa.
+                if self.good != peer_good: continue
+                hash_list = self.header_hash_list(our_chain, our_hashes, start, headers)
+                if hash_list is not None and len(hash_list) > 0:
+                    hash_chains[node] = hash_list
+                    fork_points[node] = start
             except Exception as e:
                 logging.error(e)
-            finally:
-                pass
 
         url = self.consensus(hash_chains)
         # logging.info("%s Chains[%s], Consensus:[%s]" % (self.address, hash_chains, url))
         # Replace our chain if we discovered a valid chain longer than ours
-        if len(url) > 0 and len(full_chains[url]) > len(self.chain):
-            self.chain = full_chains[url]
-            self.utxo_pool = requests.get(f"http://{url}/jutxo").json()['utxos']
-            self.current_transactions = requests.get(f"http://{url}/jtxs").json()['txs']
-            return True
+        if len(url) > 0 and len(hash_chains[url]) > len(our_hashes):
+            start = fork_points[url]
+            after = our_chain[start - 1] if start > 0 else None
+            try:
+                blocks = self.fetch_blocks(url, after, hash_chains[url][start + 1:])
+            except Exception as e:
+                logging.error("Failed to download blocks from %s: %s" % (url, e))
+                return False
+            chain = our_chain[:start] + blocks
+            if not self.valid_chain(chain):
+                return False
+            with self.chain_mutex:
+                if self.tip_generation != generation:
+                    # Our chain moved while we were downloading, the next resolution will sort it out.
+                    return False
+                return self.reorganize(start, blocks)
         return False
 
+    def fetch_headers(self, node):
+        '''
+        Download a peer's goodness status and the headers of its chain after our block locator.
+        :return: <tuple> (peer_good, start, headers), or None if the peer didn't answer properly.
+        '''
+        # Query for node's "goodness status"
+        peer_good = requests.get(f"http://{node}/good", timeout=self.peer_timeout).json()['good']
+        response = requests.get(f"http://{node}/headers", params={'from': self.block_locator()},
+                                headers=self.accept_headers(), timeout=self.peer_timeout)
+        if response.status_code != 200:
+            return None
+        data = self.decode_response(response)
+        return (peer_good, data['start'], data['headers'])
+
+    def fetch_blocks(self, node, after, hashes):
+        '''
+        Download the full blocks of a peer's chain that come after one of our blocks.
+        :param after: <dict> Last block we have in common with the peer, None for the whole chain.
+        :param hashes: <list> Hashes its headers announced for those blocks, the blocks must match them.
+        :return: <list> Blocks
+        '''
+        params = {} if after is None else {'after': self.hash(after)}
+        response = requests.get(f"http://{node}/blocks", params=params, headers=self.accept_headers(),
+                                timeout=self.peer_timeout)
+        if response.status_code != 200:
+            raise ValueError('%s does not have block %s anymore' % (node, params.get('after')))
+        data = self.decode_response(response)
+        if len(data['blocks']) < len(hashes):
+            raise ValueError('%s sent %s blocks, expected %s' % (node, len(data['blocks']), len(hashes)))
+        return self.load_chain({'chain': data['blocks'][:len(hashes)], 'hashes': hashes})
+
+    def accept_headers(self):
+        # Peers that don't know the binary format ignore it and answer in JSON.
+        if self.wire_format:
+            return {'Accept': '%s, application/json;q=0.9' % wire.MEDIA_TYPE}
+        return {'Accept': 'application/json'}
+
+    @staticmethod
+    def decode_response(response):
+        '''
+        Body of a peer's response, in whichever format it chose to answer.
+        '''
+        if response.headers.get('Content-Type', '').startswith(wire.MEDIA_TYPE):
+            return wire.loads(response.content)
+        return response.json()
+
+    def fetch_peers(self, peers, fetch):
+        '''
+        Run fetch(peer) for all peers at once in a thread pool, so resolving costs the slowest peer
+        rather than the sum of all of them. Each request times out after peer_timeout seconds and peers
+        that haven't answered after resolve_deadline seconds are left out.
+        :return: <dict> peer -> result of fetch, in the order of peers, for the peers that answered.
+        '''
+        if len(peers) == 0: return {}
+        pool = ThreadPoolExecutor(max_workers=min(len(peers), self.max_fetch_threads))
+        futures = {peer: pool.submit(fetch, peer) for peer in peers}
+        done, not_done = wait(futures.values(), timeout=self.resolve_deadline)
+        # Don't wait for stragglers, their requests time out on their own.
+        pool.shutdown(wait=False)
+        results = {}
+        for peer, future in futures.items():
+            if future in not_done:
+                logging.error("Peer %s missed the resolve deadline" % peer)
+            elif future.exception() is not None:
+                logging.error(future.exception())
+            elif future.result() is not None:
+                results[peer] = future.result()
+        return results
+
     def force_resolve(self):
         # this function is called in another thread,
         # we wait to make sure new block is added to our chain
@@ -470,42 +788,590 @@ class Blockchain(object):
             requests.get(f"http://{node}/nodes/resolve")
 
 
+    ############################## CHAIN STATE FUNCTIONS ##############################
+
+    # The UTXO pool always reflects our chain plus the transactions of the mempool (current_transactions).
+    # Switching to another chain is done locally: the mempool and our blocks down to the fork point are
+    # rolled back with the undo data kept for every block, then the new blocks are applied and the
+    # transactions that fell out of the chain go back to the mempool. Costs O(reorg depth + mempool).
+
+    def reorganize(self, start, blocks):
+        '''
+        Replace the blocks of our chain from position start on with blocks.
+        Nothing is changed if one of the new blocks doesn't apply (invalid or double spent transactions).
+        :param start: <int> Position of the first new block, our blocks before it are kept.
+        :param blocks: <list> Validated Blocks (see valid_chain) following chain[start - 1].
+        :return: <bool> True if our chain was replaced.
+        '''
+        with self.chain_mutex:
+            mempool = self.current_transactions
+            old_blocks = self.chain[start:]
+            for tx in reversed(mempool):
+                self.disconnect_tx(tx, tx['ins'])
+            orphans = []
+            for block in reversed(old_blocks):
+                orphans = [tx for tx in block['transactions'] if not tx['coinbase']] + orphans
+                self.disconnect_block(block)
+
+            connected = []
+            for block in blocks:
+                if not self.connect_block(block):
+                    logging.info("Block %s doesn't apply, keeping our chain" % block['index'])
+                    # Put everything back the way it was.
+                    for b in reversed(connected):
+                        self.disconnect_block(b)
+                    for b in old_blocks:
+                        self.connect_block(b)
+                    self.current_transactions = []
+                    self.restore_mempool(mempool)
+                    return False
+                connected.append(block)
+
+            included = set(tx['hash'] for block in blocks for tx in block['transactions'])
+            self.current_transactions = []
+            self.restore_mempool([tx for tx in orphans + mempool if tx['hash'] not in included])
+            self.chain = self.chain[:start] + list(blocks)
+            self.tip_generation += 1
+            self.store_blocks(start, blocks)
+            return True
+
+    def connect_block(self, block):
+        '''
+        Apply the transactions of a block to the UTXO pool and keep its undo data.
+        :return: <bool> False (and the pool untouched) if a transaction is invalid.
+        '''
+        undo = []
+        txs = block['transactions']
+        # Exactly one coinbase and it comes first, otherwise a block could mint as many rewards as it likes.
+        if len(txs) == 0 or not txs[0]['coinbase'] or any(tx['coinbase'] for tx in txs[1:]):
+            return False
+        try:
+            valid = all(self.verifier.verify_many(txs))
+        except (KeyError, TypeError, ValueError) as e:
+            logging.info("Malformed transaction in block %s: %s" % (block['index'], e))
+            return False
+        for tx in txs:
+            try:
+                applies = valid and self.valid_tx(tx) == True
+            except (KeyError, TypeError, ValueError) as e:
+                logging.info("Malformed transaction in block %s: %s" % (block['index'], e))
+                applies = False
+            # Once valid_tx accepted it, update_utxo_pool can't fail half way.
+            if not applies:
+                for done, spent in reversed(list(zip(txs, undo))):
+                    self.disconnect_tx(done, spent)
+                return False
+            undo.append([] if tx['coinbase'] else [self.utxo_pool.get(i['tx_hash'], i['output_index']) for i in tx['ins']])
+            self.update_utxo_pool(tx)
+        self.block_undo[self.hash(block)] = undo
+        return True
+
+    def disconnect_block(self, block):
+        '''
+        Undo connect_block: remove the outputs of the block's transactions and give back what they spent.
+        '''
+        txs = block['transactions']
+        undo = self.block_undo.pop(self.hash(block), None)
+        if undo is None:
+            # A transaction spends exactly the UTXOs it lists as inputs.
+            undo = [tx['ins'] for tx in txs]
+        for tx, spent in reversed(list(zip(txs, undo))):
+            self.disconnect_tx(tx, spent)
+
+    def disconnect_tx(self, tx, spent):
+        for ix in range(len(tx['outs'])):
+            self.utxo_pool.spend({'tx_hash': tx['hash'], 'output_index': ix})
+        if not tx['coinbase']:
+            for utxo in spent:
+                self.utxo_pool.add(utxo)
+
+    def set_store(self, store):
+        '''
+        Keep our chain on disk in store (see store.py), starting from the chain it already holds if any.
+        The node's keypair is kept there too, the coinbases of the stored chain are paid to it.
+        '''
+        with self.chain_mutex:
+            self.store = store
+            sk = store.load_key()
+            if sk is None:
+                store.save_key(self.sk)
+            else:
+                self.sk, self.vk = sk, SigningKey.from_string(sk).get_verifying_key().to_string()
+            if store.height > 0:
+                self.load_store()
+            elif len(self.chain) > 0:
+                self.store_blocks(0, self.chain)
+                self.checkpoint()
+
+    def load_store(self):
+        '''
+        Replace our chain with the one of the block store. The UTXO pool and the mempool come from
+        its last snapshot, the blocks stored after it are applied on top.
+        '''
+        with self.chain_mutex:
+            blocks = self.store.blocks()
+            state = self.store.load_state()
+            if state is not None and 0 < state['height'] <= len(blocks) and state['tip'] == blocks[state['height'] - 1].digest:
+                height, mempool = state['height'], state['mempool']
+                self.utxo_pool = UTXOSet(state['utxos'])
+            else:
+                logging.info("No usable UTXO snapshot, replaying the whole chain")
+                height, mempool = 0, []
+                self.utxo_pool = UTXOSet()
+            self.block_undo = {}
+            for tx in reversed(mempool):
+                self.disconnect_tx(tx, tx['ins'])
+            for position in range(height, len(blocks)):
+                if not self.connect_block(blocks[position]):
+                    logging.error("Stored block %s doesn't apply, dropping it and the ones after it" % position)
+                    del blocks[position:]
+                    self.store.truncate(position)
+                    break
+            # These are our own blocks, their proofs of work were checked before they were stored.
+            self.chain = blocks
+            self.verified_blocks = {block.digest: position for position, block in enumerate(blocks)}
+            self.current_transactions = []
+            self.restore_mempool(mempool)
+            self.tip_generation += 1
+            logging.info("Loaded %s blocks from %s" % (len(blocks), self.store.datadir))
+
+    def store_blocks(self, start, blocks):
+        '''
+        Write blocks to the block store from position start on, replacing what it had there.
+        The store is synced and the UTXO pool snapshotted every store.sync_every blocks and after
+        every reorganization.
+        '''
+        if self.store is None: return
+        with self.chain_mutex:
+            reorganized = start < self.store.height
+            self.store.truncate(start)
+            for block in blocks:
+                self.store.append(block)
+            if reorganized or self.store.pending >= self.store.sync_every:
+                self.checkpoint()
+
+    def checkpoint(self):
+        '''
+        Make the stored blocks durable and snapshot the UTXO pool and mempool at our tip.
+        '''
+        with self.chain_mutex:
+            self.store.sync()
+            if len(self.chain) == 0: return
+            self.store.save_state({'height': len(self.chain),
+                                   'tip': self.hash(self.chain[-1]),
+                                   'utxos': self.utxo_pool.to_list(),
+                                   'mempool': self.current_transactions})
+
+    def restore_mempool(self, txs):
+        '''
+        Put transactions back in the mempool, dropping the ones that are no longer valid
+        (e.g. their inputs were spent by the new chain).
+        '''
+        pending = set(tx['hash'] for tx in self.current_transactions)
+        for tx in txs:
+            if tx['coinbase'] or tx['hash'] in pending:
+                continue
+            pending.add(tx['hash'])
+            if self.valid_tx(tx) == True and self.verify_signature(tx):
+                self.current_transactions.append(tx)
+                self.update_utxo_pool(tx)
+            else:
+                logging.debug("Dropped transaction %s after reorganization" % tx['hash'])
+
     ############################## MESSAGING FUNCTIONS ##############################
 
     def set_msgr(self, msgr):
         self.msgr = msgr
 
     def process_message(self, msg):
-        if msg.mtype == Message.NEW_TX:
-            tx = msg.json_data()
-            logging.debug("NEW_TX: %s" % tx)
-            if not self.verify_signature(tx):
-                logging.debug('=== Ignored TX w/ Invalid Signature == %s' % tx)
+        self.process_messages([msg])
+
+    def process_messages(self, msgs):
+        '''
+        Process a batch of messages in order.
+        Consecutive NEW_TX messages are handled together, see add_gossiped_txs.
+        :param msgs: <list> Messages
+        '''
+        txs = {} # tx hash -> tx, the same transaction usually comes from several peers
+        wanted = OrderedDict() # peer -> hashes it announced that we haven't seen
+        def flush():
+            # A failure here must not take the rest of the batch down with it.
+            try:
+                self.add_gossiped_txs(list(txs.values()) + self.fetch_announced(wanted))
+            except Exception:
+                logging.exception("Failed to add gossiped transactions")
+        for msg in msgs:
+            if msg.mtype == Message.NEW_TX:
+                try:
+                    tx = msg.json_data()
+                except ValueError as e:
+                    logging.error("Malformed transaction in %s: %s" % (msg, e))
+                    continue
+                logging.debug("NEW_TX: %s" % tx)
+                if not self.well_formed_tx(tx):
+                    logging.error("Malformed transaction in %s" % msg)
+                elif tx['coinbase'] == False: #coinbase will be resolved
+                    txs.setdefault(tx['hash'], tx)
+            elif msg.mtype == Message.INV:
+                try:
+                    hashes = [h for h in msg.json_data() if isinstance(h, str)]
+                except (ValueError, TypeError) as e:
+                    logging.error("Malformed inventory in %s: %s" % (msg, e))
+                    continue
+                self.gossip_counts['inv_received'] += len(hashes)
+                unseen = self.mark_seen(hashes)
+                self.gossip_counts['inv_duplicates'] += len(hashes) - len(unseen)
+                if unseen:
+                    wanted.setdefault(msg.addr, []).extend(unseen)
+            elif msg.mtype == Message.MINE:
+                # Transactions that came before the block go in first, it may spend their outputs.
+                flush()
+                txs, wanted = {}, OrderedDict()
+                try:
+                    self.receive_block(msg)
+                except Exception:
+                    logging.exception("Failed to process block in %s" % msg)
             else:
-                logging.debug('+++ Verified New TX +++ %s' % tx)
-                if tx['coinbase'] == False: #coinbase will be resolved
-                    self.current_transactions.append(tx)
+                flush()
+                txs, wanted = {}, OrderedDict()
+                logging.error("Unsupported Message: %s" % msg)
+        flush()
+
+    def announce_block(self, block):
+        '''
+        Push a block we just mined or appended to our subscribers, see receive_block.
+        It is sent compact: the header and a short id per transaction, peers already have most of the
+        transactions in their mempool. Only the coinbase, which is never gossiped, is sent whole.
+        '''
+        if self.msgr is None: return
+        header = {key: value for key, value in block.items() if key != 'transactions'}
+        txs = block['transactions']
+        self.gossip_counts['blocks_sent'] += 1
+        self.msgr.publish_message(Message.MINE, json.dumps({
+            'good': self.good,
+            'hash': block.digest,
+            'header': header,
+            'txids': [tx['hash'][:self.short_id_length] for tx in txs],
+            'prefilled': [[i, tx] for i, tx in enumerate(txs) if tx['coinbase']]}))
+
+    def receive_block(self, msg):
+        '''
+        Add a block a peer pushed (Message.MINE) to our chain if it extends our last block, and pass it on.
+        The transactions of a compact block are taken from our mempool, the ones we don't have are
+        asked to the peer (see fetch_block_txs).
+        A block that doesn't fit but would make a longer chain means we missed some, the chain is then
+        resolved in the background as before.
+        :return: <bool> True if the block was appended.
+        '''
+        try:
+            data = msg.json_data()
+            peer_good, digest = data['good'], data['hash']
+            header = data['block'] if 'block' in data else data['header']
+            index, previous_hash = header['index'], header['previous_hash']
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error("Malformed block in %s: %s" % (msg, e))
+            return False
+        # Bad nodes only communicate with bad nodes and vice versa.
+        if self.good != peer_good: return False
+        self.gossip_counts['blocks_received'] += 1
+        with self.chain_mutex:
+            if self.chain_height(digest) is not None:
+                # Already have it, e.g. relayed by another peer.
+                return False
+            last_block = self.last_block if len(self.chain) > 0 else None
+            extends = last_block is not None and index == last_block['index'] + 1 and previous_hash == self.hash(last_block)
+            missed = not extends and index > len(self.chain)
+        if missed:
+            self.resolve_in_background()
+        if not extends:
+            return False
+
+        try:
+            if 'block' in data:
+                fields = data['block']
+            else:
+                with self.chain_mutex:
+                    txs, missing = self.rebuild_txs(data)
+                if missing:
+                    fetched = self.fetch_block_txs(msg.addr, digest, missing)
+                    self.gossip_counts['compact_txs_fetched'] += len(fetched)
+                    for position, tx in zip(missing, fetched):
+                        txs[position] = tx
+                fields = dict(header, transactions=txs)
+            # A rebuilt block is always checked, a short id may have matched the wrong transaction.
+            # Block raises ValueError when the hash doesn't match.
+            block = Block(fields, digest, verify=self.verify_blocks or 'block' not in data)
+        except (ValueError, KeyError, TypeError, IndexError, requests.RequestException) as e:
+            logging.info("Could not rebuild block %s from %s (%s), resolving instead" % (index, msg.addr, e))
+            self.resolve_in_background()
+            return False
+
+        with self.chain_mutex:
+            if len(self.chain) == 0 or previous_hash != self.hash(self.last_block):
+                # Our chain moved while we were fetching.
+                return False
+            if not self.valid_proof(self.last_block['proof'], block['proof'], block['previous_hash']):
+                logging.info("Block %s from %s has an invalid proof" % (index, msg.addr))
+                return False
+            appended = self.reorganize(len(self.chain), [block])
+            if appended:
+                self.verified_blocks[block.digest] = len(self.chain) - 1
+        if appended:
+            self.gossip_counts['blocks_appended'] += 1
+            self.announce_block(block)
+        return appended
+
+    def rebuild_txs(self, data):
+        '''
+        Transactions of a compact block, from its prefilled ones and our mempool.
+        :param data: <dict> {txids, prefilled} of a MINE message, see announce_block.
+        :return: <tuple> (list of transactions with None where we don't know them, positions of those)
+        '''
+        txs = [None] * len(data['txids'])
+        for position, tx in data['prefilled']:
+            txs[position] = tx
+        by_id = {}
+        for tx in self.current_transactions:
+            short_id = tx['hash'][:self.short_id_length]
+            # Two of ours with the same short id, ask the peer which one it is.
+            by_id[short_id] = None if short_id in by_id else tx
+        for position, short_id in enumerate(data['txids']):
+            if txs[position] is None:
+                txs[position] = by_id.get(short_id)
+        return txs, [position for position, tx in enumerate(txs) if tx is None]
+
+    def fetch_block_txs(self, peer, digest, positions):
+        '''
+        Ask a peer for some of the transactions of one of its blocks, see rebuild_txs.
+        :param peer: <str> Url of the peer, as in the messages it publishes.
+        :return: <list> Transactions at positions.
+        '''
+        response = requests.post(f"{peer}/blocks/txs", json={'hash': digest, 'positions': positions}, timeout=self.peer_timeout)
+        if response.status_code != 200:
+            raise ValueError("Peer doesn't have block %s" % digest)
+        txs = response.json()['txs']
+        if len(txs) != len(positions):
+            raise ValueError("Expected %s transactions, got %s" % (len(positions), len(txs)))
+        return txs
+
+    def block_txs(self, digest, positions):
+        '''
+        Transactions at positions of the block of our chain with hash digest, see /blocks/txs.
+        :return: <list> Transactions, or None if the block isn't in our chain.
+        '''
+        with self.chain_mutex:
+            height = self.chain_height(digest)
+            if height is None:
+                return None
+            txs = self.chain[height]['transactions']
+            return [txs[i] for i in positions if 0 <= i < len(txs)]
+
+    def chain_height(self, digest):
+        '''
+        Position of the block with hash digest in our chain.
+        verified_blocks also holds blocks of peer chains we checked but didn't adopt.
+        :return: <int> or None if the block isn't in our chain.
+        '''
+        with self.chain_mutex:
+            height = self.verified_blocks.get(digest)
+            if height is None or height >= len(self.chain) or self.hash(self.chain[height]) != digest:
+                return None
+            return height
+
+    def resolve_in_background(self):
+        '''
+        Run resolve_conflicts in another thread, unless one is already running.
+        '''
+        if not self.resolve_mutex.acquire(blocking=False): return
+        self.gossip_counts['blocks_resolved'] += 1
+        def resolve():
+            try:
+                self.resolve_conflicts()
+            except Exception as e:
+                logging.error(e)
+            finally:
+                self.resolve_mutex.release()
+        thr = Thread(target=resolve)
+        thr.daemon = True
+        thr.start()
+
+    def mark_seen(self, hashes):
+        '''
+        Remember transaction hashes in the bounded seen set.
+        :return: <list> The hashes that weren't in it.
+        '''
+        unseen = []
+        with self.chain_mutex:
+            for h in hashes:
+                if h in self.seen_txs:
+                    continue
+                self.seen_txs[h] = True
+                unseen.append(h)
+            while len(self.seen_txs) > self.seen_size:
+                self.seen_txs.popitem(last=False)
+        return unseen
+
+    def forget_seen(self, hashes):
+        '''
+        Take hashes out of the seen set, so the next announcement of them is fetched again.
+        '''
+        with self.chain_mutex:
+            for h in hashes:
+                self.seen_txs.pop(h, None)
+
+    def announce_txs(self, txs):
+        '''
+        Tell our subscribers which transactions we have, they ask for the bodies they lack (see fetch_txs).
+        '''
+        hashes = [tx['hash'] for tx in txs]
+        self.mark_seen(hashes)
+        if self.msgr is not None and hashes:
+            self.gossip_counts['inv_sent'] += len(hashes)
+            self.msgr.publish_message(Message.INV, json.dumps(hashes))
+
+    def fetch_announced(self, wanted):
+        '''
+        Download the transactions peers announced and we lack, from all of them at once.
+        :param wanted: <dict> peer url -> hashes to ask it for
+        :return: <list> Transactions
+        '''
+        if len(wanted) == 0: return []
+        fetched = self.fetch_peers(list(wanted), lambda peer: self.fetch_txs(peer, wanted[peer]))
+        txs = []
+        for peer, bodies in fetched.items():
+            # Only well formed bodies of what we asked that peer for, whatever else it sent.
+            requested = set(wanted[peer])
+            bodies = [tx for tx in (bodies if isinstance(bodies, list) else [])
+                      if self.well_formed_tx(tx) and tx['hash'] in requested and tx['coinbase'] == False]
+            txs.extend(bodies)
+        # Forget what we didn't get, so the next announcement of it is fetched again.
+        received = set(tx['hash'] for tx in txs)
+        self.forget_seen([h for hashes in wanted.values() for h in hashes if h not in received])
+        self.gossip_counts['tx_fetched'] += len(txs)
+        return txs
+
+    def fetch_txs(self, peer, hashes):
+        '''
+        Ask a peer for the bodies of some of its mempool transactions.
+        :param peer: <str> Url of the peer, as in the messages it publishes.
+        :return: <list> Transactions, without the ones it doesn't have anymore.
+        '''
+        response = requests.post(f"{peer}/txs/bodies", json={'hashes': hashes}, timeout=self.peer_timeout)
+        if response.status_code != 200:
+            return []
+        return response.json()['txs']
+
+    def mempool_txs(self, hashes):
+        '''
+        Transactions of the mempool with these hashes, see /txs/bodies.
+        '''
+        wanted = set(hashes)
+        with self.chain_mutex:
+            return [tx for tx in self.current_transactions if tx['hash'] in wanted]
+
+    def add_gossiped_txs(self, txs):
+        '''
+        Add transactions received from peers to the mempool and announce the ones we took to our own subscribers.
+        Their signatures are checked together (in the verifier's process pool if it has one), then the
+        valid ones that aren't in the mempool yet and spend unspent outputs are added in one go.
+        '''
+        if len(txs) == 0: return
+        accepted, rejected = [], []
+        signed = self.verifier.verify_many(txs)
+        with self.chain_mutex:
+            pending = set(tx['hash'] for tx in self.current_transactions)
+            for tx, valid in zip(txs, signed):
+                if not valid:
+                    logging.debug('=== Ignored TX w/ Invalid Signature == %s' % tx)
+                    rejected.append(tx['hash'])
+                elif tx['hash'] in pending:
+                    continue
+                elif self.valid_tx(tx) != True:
+                    # Maybe its parent hasn't reached us yet.
+                    logging.debug('=== Ignored TX spending unknown or repeated outputs == %s' % tx)
+                    rejected.append(tx['hash'])
+                else:
+                    logging.debug('+++ Verified New TX +++ %s' % tx)
+                    # In the mempool only once its inputs are spent in the pool.
                     self.update_utxo_pool(tx)
-        else:
-            logging.error("Unsupported Message: %s" % msg)
+                    self.current_transactions.append(tx)
+                    pending.add(tx['hash'])
+                    accepted.append(tx)
+        # Only what we took stays seen, a rejected transaction is fetched again when it is announced again.
+        self.forget_seen(set(rejected) - pending)
+        self.announce_txs(accepted)
 
     def process_mqueue(self):
+        '''
+        Process the messages waiting in the queue, without waiting for more.
+        '''
+        while self.mqueue.qsize() > 0:
+            self.handle_messages(self.next_messages(block=False))
+
+    def consume_messages(self):
+        '''
+        Process messages as soon as they arrive, forever. Runs in the consumer thread.
+        '''
         while True:
-            if len(self.mqueue) == 0: break
-            #depends on the format of data split by space may not work properly
-            msg = Message(self.mqueue[0])
-            self.process_message(msg)
-            self.pop_message()
+            self.handle_messages(self.next_messages())
 
-    def pop_message(self):
-        self.mqueue_mutex.acquire()
-        self.mqueue.pop(0)
-        self.mqueue_mutex.release()
+    def next_messages(self, block=True):
+        '''
+        Up to mqueue_batch messages from the queue: the first one (waiting for it if block), and the
+        ones that came in meanwhile.
+        '''
+        batch = []
+        try:
+            if block:
+                batch.append(self.mqueue.get())
+            while len(batch) < self.mqueue_batch:
+                batch.append(self.mqueue.get_nowait())
+        except Empty:
+            pass
+        return batch
+
+    def start_consumer(self):
+        self.consumer = Thread(target=self.consume_messages)
+        self.consumer.daemon = True
+        self.consumer.start()
+
+    def handle_messages(self, batch):
+        '''
+        :param batch: <list> (msg, time received) from the queue.
+        '''
+        msgs = []
+        for msg, _ in batch:
+            try:
+                #depends on the format of data split by space may not work properly
+                msgs.append(Message(msg))
+            except (IndexError, ValueError):
+                logging.error("Malformed message %s" % msg)
+        try:
+            self.process_messages(msgs)
+        except Exception as e:
+            # A bad message must not take the consumer down.
+            logging.error("Failed to process messages: %s" % e)
+        now = time()
+        for _, received in batch:
+            self.mqueue_latency.append(now - received)
+            self.mqueue_processed += 1
+            self.mqueue.task_done()
 
     def push_message(self, msg):
-        self.mqueue_mutex.acquire()
-        self.mqueue.append(msg)
-        self.mqueue_mutex.release()
+        self.mqueue.put((msg, time()))
+        self.mqueue_max_depth = max(self.mqueue_max_depth, self.mqueue.qsize())
+
+    def mqueue_stats(self):
+        latency = sorted(self.mqueue_latency)
+        percentile = lambda p: latency[min(int(p * len(latency)), len(latency) - 1)] if latency else 0
+        return {'depth': self.mqueue.qsize(),
+                'max_depth': self.mqueue_max_depth,
+                'processed': self.mqueue_processed,
+                'latency_avg': sum(latency) / len(latency) if latency else 0,
+                'latency_p50': percentile(0.5),
+                'latency_p99': percentile(0.99),
+                'latency_max': latency[-1] if latency else 0,
+                'gossip': dict(self.gossip_counts)}
 
 
     ############################## NODE/PEER FUNCTIONS ##############################
@@ -549,7 +1415,7 @@ class Blockchain(object):
         while True:
             counter += 1
             sleep(1)
-            self.process_mqueue() #check msg queue every 1s
+            # Messages are processed by the consumer thread as they arrive (see start_consumer).
             # Peer registration, we don't need full pairwise network now.
             # Nodes can only talked to specified peers.
             continue
@@ -579,6 +1445,9 @@ class Blockchain(object):
         :param block: <dict> Block or Transaction
         :return: <str>
         """
+        if isinstance(block, Block):
+            # Computed once when the Block was created or received.
+            return block.digest
 
         # We must make sure that the Dictionary is Ordered,
         # or we'll have inconsistent hashes
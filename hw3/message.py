@@ -5,14 +5,14 @@ class Message:
     '''
     MINE = '1'
     NEW_TX = '2'
+    INV = '3' # hashes of transactions the sender has, peers fetch the ones they lack over HTTP.
 
     # separator
     SEPARATOR = "::"
 
     def __init__(self, msg):
-        self.addr = msg.split(self.SEPARATOR)[0]
-        self.mtype = msg.split(self.SEPARATOR)[1]
-        self.data = msg.split(self.SEPARATOR)[2]
+        # The data (e.g. a block) may contain the separator itself.
+        self.addr, self.mtype, self.data = msg.split(self.SEPARATOR, 2)
 
     @classmethod
     def to_str(self, addr, mtype, data):
@@ -9,6 +9,7 @@ logging.basicConfig(level=logging.DEBUG)
 class Messenger:
     def __init__(self):
         self._publishers = set()
+        self._pub_mutex = threading.Lock() # zmq sockets aren't thread safe, the consumer thread relays too.
 
     def unsubscribe(self, http_url):
         logging.debug("Unsubscribe to %s" % self.http_to_tcp(http_url))
@@ -77,6 +78,7 @@ class Messenger:
     def publish_message(self, msg_type, msg):
         msg = Message.to_str(self._http_url, str(msg_type), msg)
         logging.debug("publishing message: [%s]" % msg)
-        self._pub_socket.send_string(msg)
+        with self._pub_mutex:
+            self._pub_socket.send_string(msg)
         time.sleep(0.01)
 
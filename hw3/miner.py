@@ -0,0 +1,222 @@
+'''
+Pluggable proof of work search engines for the GoodCoin.
+
+A miner is any object with a search(last_proof, last_hash, should_stop=None) method returning a proof
+accepted by Blockchain.valid_proof, or None when should_stop() turned True before one was found.
+Plug one into a node with blockchain.set_miner(miner); without a miner the node falls back to the
+single threaded loop in Blockchain.proof_of_work.
+'''
+import logging
+import multiprocessing
+import queue
+import threading
+from time import time, sleep
+from proof import ProofChecker
+from block import Block
+
+logging.basicConfig(level=logging.INFO)
+
+# Cancellation flag shared with the pool workers, set by the pool initializer.
+_cancel = None
+
+
+def _init_worker(cancel):
+    global _cancel
+    _cancel = cancel
+
+
+def _search_range(worker_id, num_workers, chunk, last_proof, last_hash):
+    '''
+    Scans this worker's share of the nonce space until a valid proof is found or the search is cancelled.
+    Worker w owns the chunks [(j * num_workers + w) * chunk, (j * num_workers + w + 1) * chunk) for j = 0, 1, ...
+    so the ranges of the workers never overlap.
+
+    :return: <tuple> (worker_id, proof or None, number of hashes tried, seconds spent)
+    '''
+    start = time()
+    checker = ProofChecker(last_proof, last_hash)
+    j = 0
+    while not _cancel.is_set():
+        first = (j * num_workers + worker_id) * chunk
+        proof = checker.search(first, first + chunk)
+        if proof is not None:
+            return (worker_id, proof, checker.hashes, time() - start)
+        j += 1
+    return (worker_id, None, checker.hashes, time() - start)
+
+
+class ParallelMiner(object):
+    '''
+    Splits the nonce space across a pool of processes. As soon as one worker finds a valid proof
+    all the others are cancelled, and the hash rate of every worker is kept in self.stats.
+    '''
+
+    def __init__(self, workers=None, chunk=5000):
+        '''
+        :param workers: <int> Number of worker processes, defaults to the number of cores.
+        :param chunk: <int> Number of nonces a worker tries between two checks of the cancel flag.
+        '''
+        self.workers = workers or multiprocessing.cpu_count()
+        self.chunk = chunk
+        self.stats = []
+        self._cancel = multiprocessing.Event()
+        self._pool = None
+
+    def start(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers, initializer=_init_worker, initargs=(self._cancel,))
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def search(self, last_proof, last_hash, should_stop=None, poll=0.05):
+        '''
+        Finds a proof p such that Blockchain.valid_proof(last_proof, p, last_hash) is True.
+
+        :param last_proof: <int> Proof of the last block
+        :param last_hash: <str> Hash of the last block
+        :param should_stop: <callable> (Optional) Polled every `poll` seconds, cancels the search when it says True.
+        :return: <int> A valid proof, or None if the search was cancelled
+        '''
+        self.start()
+        self._cancel.clear()
+        results = queue.Queue()
+        for worker_id in range(self.workers):
+            self._pool.apply_async(_search_range,
+                                   (worker_id, self.workers, self.chunk, last_proof, last_hash),
+                                   callback=results.put, error_callback=results.put)
+        proof = None
+        stopped = False
+        stats = []
+        for _ in range(self.workers):
+            result = None
+            while result is None:
+                try:
+                    result = results.get(timeout=poll)
+                except queue.Empty:
+                    if not stopped and should_stop is not None and should_stop():
+                        stopped = True
+                        self._cancel.set()
+            if isinstance(result, Exception):
+                self._cancel.set()
+                raise result
+            worker_id, found, hashes, seconds = result
+            if found is not None and proof is None:
+                proof = found
+                # Tell the other workers to give up, they will report their stats on the way out.
+                self._cancel.set()
+            stats.append({'worker': worker_id,
+                          'hashes': hashes,
+                          'seconds': seconds,
+                          'hashrate': hashes / seconds if seconds > 0 else 0})
+        self.stats = sorted(stats, key=lambda s: s['worker'])
+        if stopped:
+            return None
+        logging.debug("Parallel PoW found proof %s: %s" % (proof, self.stats))
+        return proof
+
+    @property
+    def hashrate(self):
+        # Combined hashes/sec of all workers during the last search.
+        return sum(s['hashrate'] for s in self.stats)
+
+
+class MiningService(object):
+    '''
+    Mines in a background thread of the node so PoW never runs on an HTTP worker.
+
+    Work is handed to the mining thread through a queue: start() queues continuous mining (one block
+    after the other until stop()), request_block() queues a single block once the mempool is full.
+    Each block is built from whatever is in the mempool when its proof is found.
+    '''
+    CONTINUOUS = 'continuous'
+    MEMPOOL_FULL = 'mempool_full'
+
+    def __init__(self, blockchain):
+        self.blockchain = blockchain
+        self.jobs = queue.Queue()
+        self.continuous = False
+        self.mining = False
+        self.blocks_mined = 0
+        self._stops = 0 # bumped by stop(), a job queued before it is abandoned.
+        self._thread = None
+
+    def run(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.work)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def start(self):
+        '''
+        Switch continuous mining on.
+        '''
+        if not self.continuous:
+            self.continuous = True
+            self.jobs.put((self.CONTINUOUS, self._stops))
+
+    def stop(self):
+        '''
+        Switch continuous mining off and abandon the block being mined.
+        '''
+        self.continuous = False
+        while not self.jobs.empty():
+            try:
+                self.jobs.get_nowait()
+            except queue.Empty:
+                break
+        self._stops += 1
+
+    def request_block(self):
+        '''
+        Ask for one block to be mined, e.g. because the mempool reached transactions_per_block.
+        Returns right away, requests made while one is already waiting are merged.
+        '''
+        if self.jobs.empty():
+            self.jobs.put((self.MEMPOOL_FULL, self._stops))
+
+    def work(self):
+        bc = self.blockchain
+        while True:
+            # The stop counter of when the job was queued, so a stop() that comes before
+            # the job is picked up still cancels it.
+            job, stops = self.jobs.get()
+            if len(bc.chain) == 0:
+                # Nothing to mine on until we have the genesis block.
+                sleep(1)
+            elif job == self.CONTINUOUS or len(bc.current_transactions) >= bc.transactions_per_block:
+                self.mining = True
+                try:
+                    # mine() gives None when abandoned and an error message for an invalid mempool.
+                    if isinstance(bc.mine(should_stop=lambda: self._stops != stops), Block):
+                        self.blocks_mined += 1
+                except Exception as e:
+                    logging.error("Background mining failed: %s" % e)
+                finally:
+                    self.mining = False
+            if job == self.CONTINUOUS and self.continuous and self.jobs.empty():
+                self.jobs.put((self.CONTINUOUS, stops))
+
+    def template(self):
+        '''
+        The block currently being mined, without its proof.
+        '''
+        bc = self.blockchain
+        if not self.mining or len(bc.chain) == 0:
+            return None
+        with bc.chain_mutex:
+            last_block = bc.last_block
+            return {'index': last_block['index'] + 1,
+                    'previous_hash': bc.hash(last_block),
+                    'transactions': [tx['hash'] for tx in bc.current_transactions]}
+
+    def status(self):
+        return {'continuous': self.continuous,
+                'mining': self.mining,
+                'queued': self.jobs.qsize(),
+                'blocks_mined': self.blocks_mined,
+                'hashrate': self.blockchain.hashrate,
+                'template': self.template()}
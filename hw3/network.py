@@ -18,7 +18,6 @@ import matplotlib.pyplot as plt
 import server
 
 import json
-import hashlib
 
 logging.basicConfig(level=logging.INFO)
 
@@ -63,13 +62,36 @@ class Node():
         except requests.exceptions.RequestException as e:
             logging.error("Fail to create genesis block %s : %s" % (self.url, e))
 
+    def stream_chain(self):
+        '''
+        Generator of {block, hash} for every block of this node's chain, read from /jchain as it streams in.
+        '''
+        response = requests.get(self.url+"/jchain", params={'format': 'ndjson'}, stream=True)
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
     def chain(self):
         try:
-            chain = requests.get(self.url+"/jchain").json()['chain']
-            return chain
+            return [item['block'] for item in self.stream_chain()]
         except requests.exceptions.RequestException as e:
             logging.error("Fail to resolve %s : %s" % (self.url, e))
 
+    def hash_list(self):
+        '''
+        Hash list of this node's chain, in the format of Blockchain.get_hash_list.
+        Uses the block hashes served with /jchain rather than hashing the blocks again, and only
+        keeps the hashes in memory.
+        '''
+        try:
+            hash_list, last_hash = [], []
+            for item in self.stream_chain():
+                hash_list.append(item['block']['previous_hash'])
+                last_hash = [item['hash']]
+            return hash_list + last_hash
+        except requests.exceptions.RequestException as e:
+            logging.error("Fail to get hash list %s : %s" % (self.url, e))
+
     def resolve(self):
         try:
             requests.get(self.url+"/nodes/resolve")
@@ -128,7 +150,8 @@ class Network():
             for node_name in node_names:
                 self.topology[node_name].resolve()
                 if len(node_names) == 1: return
-                current_chain = self.topology[node_name].chain()
+                # Equal hash lists mean equal chains, no need to compare every block.
+                current_chain = self.topology[node_name].hash_list()
                 if last_chain is None:
                     last_chain = current_chain
                     last_name = node_name
@@ -141,14 +164,7 @@ class Network():
                 logging.info("Resolved")
                 # after successfully resolving everything, display the chain
                 # pick any of the chains
-                chain = self.topology[node_names[0]].chain()
-                l = []
-                for block in chain:
-                    l.append(block['previous_hash'])
-                if len(chain) > 0:
-                    block_string = json.dumps(chain[-1], sort_keys=True).encode()
-                    last_block = hashlib.sha256(block_string).hexdigest()
-                    l.append(last_block)
+                l = last_chain
                 # just print it
                 print('=====DISPLAYING HASH LIST=====')
                 print(l)
@@ -156,14 +172,7 @@ class Network():
                 return
             time.sleep(1)
         for i in range(9):
-            chain = self.topology[node_names[i]].chain()
-            l = []
-            for block in chain:
-                l.append(block['previous_hash'])
-            if len(chain) > 0:
-                block_string = json.dumps(chain[-1], sort_keys=True).encode()
-                last_block = hashlib.sha256(block_string).hexdigest()
-                l.append(last_block)
+            l = self.topology[node_names[i]].hash_list()
             # just print it
             print('=====DISPLAYING HASH LIST=====')
             print(l)
@@ -194,12 +203,11 @@ class Network():
                 n2k['sk'] = res.json()['sk']
 
             logging.info("TX: %s:%s => %s:%s" % (n1, n1k['pk'], n2, n2k['pk']))
-            res = requests.get(node1.url+"/jutxo")
+            res = requests.get(node1.url+"/utxo/"+n1k['pk'], params={'limit': 1})
             if res.status_code == 200:
                 utxos = res.json()['utxos']
             for utxo in utxos:
-                if utxo['addr'] == n1k['pk']:
-                    in_tx = utxo
+                in_tx = utxo
             if in_tx is None:
                 logging.info("Transaction Failed: No UTXO for %s exists" % n1)
                 return
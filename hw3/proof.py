@@ -0,0 +1,59 @@
+'''
+Fast path for the proof of work inner loop.
+
+Blockchain.valid_proof is the rule: sha256(f'{last_proof}{proof}{last_hash}') must start with four
+hex zeroes. ProofChecker accepts exactly the same proofs but is built for trying millions of them:
+ - the sha256 state after the constant last_proof prefix is computed once and copy()'d per guess,
+ - the raw digest is compared against a target instead of building a hex string,
+ - nonces are formatted a batch at a time.
+'''
+import hashlib
+
+
+class ProofChecker(object):
+
+    def __init__(self, last_proof, last_hash, difficulty=4, batch=1000):
+        '''
+        :param last_proof: <int> Previous Proof
+        :param last_hash: <str> Hash of the previous Block
+        :param difficulty: <int> Number of leading hex zeroes the hash must have.
+        :param batch: <int> Number of nonces formatted at once by search.
+        '''
+        self.midstate = hashlib.sha256(f'{last_proof}'.encode())
+        self.suffix = f'{last_hash}'.encode()
+        # A digest has `difficulty` leading hex zeroes iff it is smaller than 16 ** (64 - difficulty).
+        # 16 ** 64 doesn't fit in 32 bytes: with difficulty 0 every digest is below 33 0xff bytes.
+        self.target = (16 ** (64 - difficulty)).to_bytes(32, 'big') if difficulty > 0 else b'\xff' * 33
+        self.batch = batch
+        self.hashes = 0 # number of guesses tried by search so far.
+
+    def check(self, proof):
+        '''
+        Same answer as Blockchain.valid_proof(last_proof, proof, last_hash).
+        '''
+        h = self.midstate.copy()
+        h.update(f'{proof}'.encode() + self.suffix)
+        return h.digest() < self.target
+
+    def search(self, start=0, stop=None, should_stop=None):
+        '''
+        Returns the first valid proof in [start, stop), or None if there is none.
+        Without a stop the search goes on until it finds one.
+
+        :param should_stop: <callable> (Optional) Polled once per batch, the search returns None when it says True.
+        '''
+        midstate, suffix, target = self.midstate, self.suffix, self.target
+        first = start
+        while stop is None or first < stop:
+            if should_stop is not None and should_stop():
+                return None
+            last = first + self.batch if stop is None else min(first + self.batch, stop)
+            for proof, guess in zip(range(first, last), [b'%d%s' % (p, suffix) for p in range(first, last)]):
+                h = midstate.copy()
+                h.update(guess)
+                if h.digest() < target:
+                    self.hashes += proof - first + 1
+                    return proof
+            self.hashes += last - first
+            first = last
+        return None
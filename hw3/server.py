@@ -1,6 +1,7 @@
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, jsonify, request, render_template, stream_with_context
 from argparse import ArgumentParser
 from blockchain import Blockchain
+import atexit
 import threading
 import requests
 import logging
@@ -9,6 +10,9 @@ import zmq
 import time, datetime, json
 from messenger import Messenger
 from message import Message
+from miner import ParallelMiner, MiningService
+from store import BlockStore
+import wire
 
 
 logging.basicConfig(level=logging.INFO)
@@ -23,6 +27,9 @@ blockchain = Blockchain()
 # Messenger init
 msgr = Messenger()
 
+# Background miner
+mining_service = MiningService(blockchain)
+
 ############################## NAVBAR CONTROLS ##############################
 
 @app.route('/')
@@ -39,10 +46,17 @@ def mining():
 
 @app.route('/chain', methods=['GET'])
 def chain():
+    # Shows ?start= to ?end=, the last 20 blocks by default.
+    try:
+        start, end = block_range(default_count=20)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    encodings, hashes, length = blockchain.raw_blocks(start, end)
     response = {
-        'length': len(blockchain.chain),
-        'chain': blockchain.chain
-
+        'length': length,
+        'start': start,
+        'end': start + len(encodings),
+        'chain': [encoding.decode() for encoding in encodings]
     }
     return render_template('blockchain.html', blockchain=response)
 
@@ -55,13 +69,70 @@ def txs():
     # print(blockchain.utxo_pool)
     return render_template('txs.html', txs=response)
 
+def wants_ndjson():
+    # Streaming is asked for with ?format=ndjson or an Accept: application/x-ndjson header.
+    return request.args.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+
+def ndjson_response(lines):
+    '''
+    Stream one JSON document per line as the generator yields them, the whole response is never built in memory.
+    '''
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+def page_limit(default=None):
+    limit = request.args.get('limit', default, type=int)
+    if limit is not None and limit <= 0:
+        raise ValueError('limit must be > 0')
+    return limit
+
 @app.route('/jtxs', methods=['GET'])
 def full_txs():
+    '''
+    The mempool, all of it or ?limit= transactions after the one with hash ?cursor=.
+    '''
+    txs = list(blockchain.current_transactions)
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        positions = [i for i, tx in enumerate(txs) if tx['hash'] == cursor]
+        if len(positions) == 0:
+            return jsonify({'message': 'Transaction %s is not in the mempool anymore' % cursor}), 404
+        txs = txs[positions[0] + 1:]
+    try:
+        limit = page_limit()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    if wants_ndjson():
+        return ndjson_response(json.dumps(tx) + '\n' for tx in txs[:limit])
     response = {
-        'txs': blockchain.current_transactions
+        'txs': txs[:limit],
+        'next_cursor': txs[limit - 1]['hash'] if limit is not None and len(txs) > limit else None,
     }
     return jsonify(response), 200
 
+@app.route('/txs/bodies', methods=['POST'])
+def tx_bodies():
+    '''
+    Mempool transactions with the hashes in the posted {"hashes": [...]}, peers ask for the ones announced to them (Message.INV).
+    '''
+    values = request.get_json(silent=True) or {}
+    if not isinstance(values.get('hashes'), list):
+        return jsonify({'message': 'Expected {"hashes": [...]}'}), 400
+    return jsonify({'txs': blockchain.mempool_txs(values['hashes'])}), 200
+
+@app.route('/blocks/txs', methods=['POST'])
+def block_txs():
+    '''
+    Transactions of one of our blocks, the posted {"hash": ..., "positions": [...]}.
+    Peers ask for the ones of a compact block (Message.MINE) they don't have in their mempool.
+    '''
+    values = request.get_json(silent=True) or {}
+    if not isinstance(values.get('positions'), list) or not all(isinstance(i, int) for i in values['positions']):
+        return jsonify({'message': 'Expected {"hash": ..., "positions": [...]}'}), 400
+    txs = blockchain.block_txs(values.get('hash'), values['positions'])
+    if txs is None:
+        return jsonify({'message': 'Unknown block'}), 404
+    return jsonify({'txs': txs}), 200
+
 @app.route('/genesis', methods=['GET'])
 def genesis():
     blockchain.genesis()
@@ -75,7 +146,7 @@ def keys():
 def utxo():
     response = {
         'num_utxos': len(blockchain.utxo_pool),
-        'utxos': blockchain.utxo_pool
+        'utxos': blockchain.utxo_pool.to_list()
     }
     return render_template('utxo.html', utxo=response)
 
@@ -112,6 +183,23 @@ def mine():
     #return jsonify(response), 200
     return render_template('mining.html', mine_info=response)
 
+@app.route('/mine/start', methods=['GET', 'POST'])
+def start_mining():
+    '''
+    Mine blocks one after the other in the background until /mine/stop.
+    '''
+    mining_service.start()
+    return jsonify(mining_service.status()), 200
+
+@app.route('/mine/stop', methods=['GET', 'POST'])
+def stop_mining():
+    mining_service.stop()
+    return jsonify(mining_service.status()), 200
+
+@app.route('/mine/status', methods=['GET'])
+def mining_status():
+    return jsonify(mining_service.status()), 200
+
 @app.route('/transactions/new', methods=['POST'])
 def new_transaction():
     # Check for required fields.
@@ -138,8 +226,8 @@ def new_transaction():
     valid = blockchain.new_transaction(inputs, outputs, values['priv_key'])
     print(valid)
     if len(blockchain.current_transactions) >= blockchain.transactions_per_block:
-            blockchain.mine()
-            return blockchain.last_block['index']
+        # Mined in the background so this request doesn't wait for the proof of work.
+        mining_service.request_block()
     if type(valid) == int:
         response = {'_message': f'Transaction will be added to Block {valid}',
                     'ins': values['inputs'],
@@ -162,17 +250,157 @@ def generate_keypair():
 
 @app.route('/jutxo', methods=['GET'])
 def full_utxo():
+    '''
+    The UTXO pool, all of it or a page of ?limit= UTXOs starting after ?cursor= (see UTXOSet.page).
+    '''
+    cursor = request.args.get('cursor', type=int)
+    try:
+        limit = page_limit()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    if wants_ndjson():
+        return ndjson_response(stream_utxos(cursor, limit))
+    if limit is None and cursor is None:
+        return jsonify({'utxos': blockchain.utxo_pool.to_list()}), 200
+    with blockchain.chain_mutex:
+        utxos, next_cursor = blockchain.utxo_pool.page(cursor, limit or 100)
+    return jsonify({'utxos': utxos, 'next_cursor': next_cursor}), 200
+
+def stream_utxos(cursor=None, limit=None, batch=500):
+    sent = 0
+    while limit is None or sent < limit:
+        with blockchain.chain_mutex:
+            utxos, cursor = blockchain.utxo_pool.page(cursor, batch if limit is None else min(batch, limit - sent))
+        for utxo in utxos:
+            yield json.dumps(utxo) + '\n'
+        sent += len(utxos)
+        if cursor is None:
+            break
+
+@app.route('/utxo/<addr>', methods=['GET'])
+def address_utxo(addr):
+    '''
+    UTXOs owned by one address, paginated with ?offset=&limit= (default 100 per page).
+    '''
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', 100, type=int)
+    if offset < 0 or limit <= 0:
+        return jsonify({'message': 'offset must be >= 0 and limit > 0'}), 400
+    total = blockchain.utxo_pool.count(addr)
+    response = {
+        'addr': addr,
+        'utxos': blockchain.utxo_pool.by_addr(addr, offset, limit),
+        'total': total,
+        'next_offset': offset + limit if offset + limit < total else None,
+    }
+    return jsonify(response), 200
+
+@app.route('/balance/<addr>', methods=['GET'])
+def address_balance(addr):
     response = {
-        'utxos': blockchain.utxo_pool
+        'addr': addr,
+        'balance': blockchain.utxo_pool.balance(addr),
+        'num_utxos': blockchain.utxo_pool.count(addr),
     }
     return jsonify(response), 200
 
+@app.route('/stats/verify', methods=['GET'])
+def verify_stats():
+    '''
+    Hit/miss counters of the signature verification cache.
+    '''
+    return jsonify(blockchain.verifier.stats()), 200
+
+@app.route('/stats/mqueue', methods=['GET'])
+def mqueue_stats():
+    '''
+    Depth of the gossip message queue and how long messages wait in it (seconds, over the last 1000).
+    '''
+    return jsonify(blockchain.mqueue_stats()), 200
+
+def block_range(default_count=None):
+    '''
+    Positions ?start= and ?end= (excluded) of a range of blocks, negative ones count from the end of the chain.
+    Without a start the range is the whole chain, or its last default_count blocks. ?limit= caps its size.
+    '''
+    length = len(blockchain.chain)
+    start = request.args.get('start', None if default_count is None else -default_count, type=int) or 0
+    end = request.args.get('end', length, type=int)
+    start = max(start + length if start < 0 else start, 0)
+    end = min(max(end + length if end < 0 else end, start), length)
+    limit = page_limit()
+    if limit is not None:
+        end = min(end, start + limit)
+    return start, end
+
+def wants_wire():
+    # Peers that understand the compact binary format (see wire.py) put it in their Accept header.
+    return wire.MEDIA_TYPE in request.headers.get('Accept', '')
+
+def wire_response(response):
+    return Response(wire.dumps(response), mimetype=wire.MEDIA_TYPE)
+
+def blocks_response(key, first, last=None, **fields):
+    '''
+    Response carrying our blocks from position first to last (excluded) as `key`, with their hashes.
+    In JSON the blocks are sent as they are encoded in the chain (see Blockchain.raw_blocks),
+    joined together instead of being decoded and jsonify'ed again.
+    '''
+    if wants_wire():
+        with blockchain.chain_mutex:
+            blocks = blockchain.chain[first:last]
+        fields.update({key: blocks, 'hashes': [blockchain.hash(block) for block in blocks]})
+        return wire_response(fields)
+    encodings, hashes, _ = blockchain.raw_blocks(first, last)
+    fields['hashes'] = hashes
+    body = b''.join([b'{"', key.encode(), b'": [', b', '.join(encodings), b'], ', json.dumps(fields)[1:].encode()])
+    return app.response_class(body, mimetype='application/json')
+
 @app.route('/jchain', methods=['GET'])
 def full_chain():
+    # ?start= skips the blocks a peer already has, ?end= stops before that position.
+    try:
+        start, end = block_range()
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    if wants_ndjson():
+        return ndjson_response(stream_blocks(start, end))
+    length = len(blockchain.chain)
+    next_start = end if end < length else None
+    return blocks_response('chain', start, end, length=length, start=start, next_start=next_start), 200
+
+def stream_blocks(start, end, batch=100):
+    # One {"block", "hash"} per line, read from the chain a batch at a time.
+    for first in range(start, end, batch):
+        encodings, hashes, _ = blockchain.raw_blocks(first, min(first + batch, end))
+        for encoding, block_hash in zip(encodings, hashes):
+            yield b'{"block": ' + encoding + b', "hash": "' + block_hash.encode() + b'"}\n'
+        if len(encodings) < min(batch, end - first):
+            break
+
+@app.route('/blocks', methods=['GET'])
+def blocks():
+    '''
+    Full blocks after the block ?after=<hash> (the whole chain without it).
+    '''
+    found = blockchain.get_blocks(request.args.get('after'))
+    if found is None:
+        return jsonify({'message': 'Unknown block %s' % request.args.get('after')}), 404
+    return blocks_response('blocks', found[0], start=found[0]), 200
+
+@app.route('/headers', methods=['GET'])
+def headers():
+    '''
+    Block headers after the first known hash among the ?from= block locator hashes (from genesis if none is known).
+    '''
+    start, headers = blockchain.get_headers(request.args.getlist('from'))
     response = {
-        'chain': blockchain.chain,
+        'start': start,
+        'headers': headers,
         'length': len(blockchain.chain),
     }
+    if wants_wire():
+        return wire_response(response), 200
     return jsonify(response), 200
 
 @app.route('/good', methods=['GET'])
@@ -275,15 +503,28 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--seeds', type=str, help='Initial neighboring blockchain nodes')
     parser.add_argument('-a', '--address', type=str, default="http://127.0.0.1:5000", help='Local address')
     parser.add_argument('-e', '--ensemble', action='store_true')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='Number of proof of work processes (0 = mine in a single thread)')
+    parser.add_argument('--verify-workers', type=int, default=0, help='Number of processes verifying block signatures (0 = verify in the node process)')
+    parser.add_argument('--wire', action='store_true', help='Download blocks from peers in the compact binary format (half the size, more CPU)')
+    parser.add_argument('-d', '--datadir', type=str, help='Directory keeping the chain on disk, the node restarts from it')
     args = parser.parse_args()
     blockchain.address = args.address.split("//")[1]
     blockchain.set_msgr(msgr)
+    if args.workers > 0:
+        blockchain.set_miner(ParallelMiner(args.workers))
+    blockchain.verifier.workers = args.verify_workers
+    blockchain.wire_format = args.wire
+    if args.datadir is not None:
+        blockchain.set_store(BlockStore(args.datadir))
+        atexit.register(blockchain.checkpoint)
 
     if args.seeds is not None:
         sync_with_peers(args.seeds, args.address)
     thr = threading.Thread(target=blockchain.query_nodes)
     thr.daemon = True
     thr.start()
+    blockchain.start_consumer()
+    mining_service.run()
 
     msgr.start(args.address, blockchain)
 
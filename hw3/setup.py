@@ -8,7 +8,7 @@ setup(
         'requests',
         'zmq',
         'base58',
-        'ecdsa',
+        'ecdsa>=0.19,<0.20', # verify.KeyCache.precompute relies on its PointJacobi internals
     ],
     setup_requires=[
         'pytest-runner',
@@ -0,0 +1,185 @@
+'''
+On-disk block store for the GoodCoin.
+
+A restarted node used to start from an empty chain and pull everything again through /jchain.
+With a data directory (server.py -d) a node keeps:
+ - blocks.dat: the encodings of the blocks of its chain (see Block.encoding), one per line, append only,
+ - blocks.idx: one fixed size record per block, (offset, length, hash), so block n is found without parsing,
+ - state.json: a snapshot of the UTXO pool and the mempool at some height of the chain,
+ - node.key: the node's signing key, so it can still spend the coinbases it mined after a restart.
+
+The data file is read through a memory map, so ranges of blocks are served as they are stored
+(see read and server.py /jchain) without decoding and encoding them again.
+
+Appends are only fsync'ed every sync_every blocks (see Blockchain.store_blocks), together with a
+new snapshot. Whatever a crash leaves behind the last synced block is either complete, and
+replayed on top of the snapshot at startup, or cut off when the store is opened.
+'''
+import json
+import mmap
+import os
+import struct
+from block import Block
+from threading import Lock
+
+RECORD = struct.Struct('>QI32s') # offset, length, raw sha256 of the block
+
+
+class BlockStore(object):
+
+    def __init__(self, datadir, sync_every=10):
+        '''
+        :param datadir: <str> Directory of the store, created if needed.
+        :param sync_every: <int> Number of appended blocks after which Blockchain syncs the store.
+        '''
+        self.datadir = datadir
+        self.sync_every = sync_every
+        self.pending = 0 # blocks appended since the last sync.
+        os.makedirs(datadir, exist_ok=True)
+        self._data = open(os.path.join(datadir, 'blocks.dat'), 'a+b')
+        self._idx = open(os.path.join(datadir, 'blocks.idx'), 'a+b')
+        self._index = self._read_index()
+        self._map = None # read only map of the data file, redone when the file grew past it.
+        self._mutex = Lock() # the map must not be read while the file is truncated.
+
+    def _read_index(self):
+        '''
+        Read the index and cut both files after the last complete block.
+        '''
+        self._idx.seek(0)
+        raw = self._idx.read()
+        data_size = os.fstat(self._data.fileno()).st_size
+        index, end = [], 0
+        for position in range(len(raw) // RECORD.size):
+            offset, length, digest = RECORD.unpack_from(raw, position * RECORD.size)
+            if offset != end or offset + length + 1 > data_size:
+                break
+            index.append((offset, length, digest.hex()))
+            end = offset + length + 1
+        self._idx.truncate(len(index) * RECORD.size)
+        self._data.truncate(end)
+        return index
+
+    @property
+    def height(self):
+        return len(self._index)
+
+    def append(self, block):
+        '''
+        Write a Block after the last one of the store.
+        '''
+        offset = self._index[-1][0] + self._index[-1][1] + 1 if self._index else 0
+        encoding = block.encoding
+        with self._mutex:
+            self._data.write(encoding + b'\n')
+            self._idx.write(RECORD.pack(offset, len(encoding), bytes.fromhex(block.digest)))
+            self._index.append((offset, len(encoding), block.digest))
+        self.pending += 1
+
+    def truncate(self, height):
+        '''
+        Drop the blocks from position height on, e.g. the ones a reorganization replaced.
+        '''
+        if height >= len(self._index):
+            return
+        with self._mutex:
+            self._unmap()
+            self._data.flush()
+            self._idx.flush()
+            self._data.truncate(self._index[height][0])
+            self._idx.truncate(height * RECORD.size)
+            del self._index[height:]
+
+    def sync(self):
+        # Blocks before the index, so an index record never points past the data.
+        for f in (self._data, self._idx):
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending = 0
+
+    def read(self, start=0, end=None):
+        '''
+        Encodings and hashes of the blocks from position start to end (excluded), sliced out of the mapped data file.
+        :return: <tuple> (list of encodings, list of hashes)
+        '''
+        with self._mutex:
+            index = self._index[start:end]
+            if len(index) == 0:
+                return [], []
+            last = index[-1][0] + index[-1][1]
+            if self._map is None or len(self._map) < last:
+                self._unmap()
+                self._data.flush()
+                self._map = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+            data = self._map
+            return [data[offset:offset + length] for offset, length, _ in index], [digest for _, _, digest in index]
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def blocks(self, start=0, end=None):
+        '''
+        Blocks of the store from position start to end (excluded).
+        :return: <list> Blocks
+        '''
+        encodings, digests = self.read(start, end)
+        return [Block.from_encoding(encoding, digest) for encoding, digest in zip(encodings, digests)]
+
+    def save_state(self, state):
+        '''
+        Replace the snapshot atomically: a crash leaves either the old one or the new one.
+        :param state: <dict> {height, tip, utxos, mempool}
+        '''
+        path = os.path.join(self.datadir, 'state.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        directory = os.open(self.datadir, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def load_state(self):
+        '''
+        :return: <dict> The last snapshot, or None if there is none.
+        '''
+        try:
+            with open(os.path.join(self.datadir, 'state.json')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def save_key(self, sk):
+        '''
+        Keep the node's signing key, readable by its owner only.
+        :param sk: <bytes> Raw signing key, see Blockchain.generate_keypair.
+        '''
+        path = os.path.join(self.datadir, 'node.key')
+        fd = os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(sk.hex())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def load_key(self):
+        '''
+        :return: <bytes> The signing key saved by save_key, or None if there is none.
+        '''
+        try:
+            with open(os.path.join(self.datadir, 'node.key')) as f:
+                return bytes.fromhex(f.read().strip())
+        except (IOError, ValueError):
+            return None
+
+    def close(self):
+        self.sync()
+        with self._mutex:
+            self._unmap()
+        self._data.close()
+        self._idx.close()
@@ -0,0 +1,148 @@
+'''
+Synthetic peers and chains for the consensus tests and benchmarks (see benchmark.py bench_consensus
+and bench_resolve): hash lists of honest and byzantine peers, and networks of in-process nodes.
+'''
+from collections import defaultdict
+import random
+
+from blockchain import Blockchain
+from proof import ProofChecker
+
+
+def reference_consensus(chains):
+    '''
+    The original prefix-string consensus, O(peers * length^2). Kept as the reference the trie
+    version in Blockchain.consensus must agree with.
+    '''
+    prefix_counter = defaultdict(int)
+    max_length = max([len(x) for x in chains.values()])
+
+    chain_length = {k:len(v) for k,v in chains.items()}
+    max_url = max(chain_length, key = chain_length.get)
+    if max_length <= 2: return max_url
+
+    for length in reversed(range(1, max_length+1)):
+        is_common = False
+        for chain in chains.values():
+            if len(chain) < length: continue
+            else:
+                prefix = ','.join(chain[:length])
+                prefix_counter[prefix] += 1
+                if prefix_counter[prefix] > (len(chains) / 2): is_common = True
+        if is_common: break
+        else: prefix_counter.clear()
+
+    result = (0, '')
+    for prefix in prefix_counter:
+        if prefix_counter[prefix] > (len(chains) / 2):
+            for url, chain in chains.items():
+                if ','.join(chain).startswith(prefix) and result[0] < len(chain):
+                    result = (len(chain), url)
+    return result[1]
+
+
+def random_hashes(rng, count):
+    return ['%064x' % rng.getrandbits(256) for _ in range(count)]
+
+
+def synthetic_chains(peers=10, length=100, fork_depth=5, byzantine=0.0, forks=3, seed=None):
+    '''
+    Hash lists of peers, in the get_hash_list format resolve_conflicts hands to consensus.
+    Honest peers share a trunk of `length` blocks and are 0 to fork_depth blocks ahead of it on one of
+    `forks` branches. The byzantine fraction of the peers all push the same private chain instead,
+    forked off the trunk at a random height and longer than any honest chain.
+    :return: <tuple> (chains, set of the urls of the byzantine peers)
+    '''
+    rng = random.Random(seed)
+    trunk = ['1'] + random_hashes(rng, length)
+    branches = [random_hashes(rng, fork_depth) for _ in range(forks)]
+    attack = trunk[:rng.randint(1, length)]
+    attack += random_hashes(rng, length + fork_depth + 2 - len(attack))
+    byzantine_urls = set('peer%d' % p for p in rng.sample(range(peers), int(round(peers * byzantine))))
+    chains = {}
+    for p in range(peers):
+        url = 'peer%d' % p
+        if url in byzantine_urls:
+            chains[url] = attack
+        else:
+            chains[url] = trunk + rng.choice(branches)[:rng.randint(0, fork_depth)]
+    return chains, byzantine_urls
+
+
+class SyntheticNode(Blockchain):
+    '''
+    A node whose peers are other SyntheticNodes of the same process, so resolve_conflicts runs end
+    to end (headers, consensus, block download, validation, reorganization) without any HTTP.
+    Proofs of work only need one leading zero so long chains are cheap to build, checking one
+    costs the same sha256 as a real one.
+    '''
+    difficulty = 1
+
+    def __init__(self, address, network):
+        Blockchain.__init__(self)
+        self.address = address
+        self.network = network # address -> SyntheticNode
+        network[address] = self
+
+    @staticmethod
+    def valid_proof(last_proof, proof, last_hash):
+        return ProofChecker(last_proof, last_hash, SyntheticNode.difficulty).check(proof)
+
+    def fetch_headers(self, node):
+        peer = self.network[node]
+        start, headers = peer.get_headers(self.block_locator())
+        return (peer.good, start, headers)
+
+    def fetch_blocks(self, node, after, hashes):
+        found = self.network[node].get_blocks(None if after is None else self.hash(after))
+        if found is None:
+            raise ValueError('%s does not have block %s anymore' % (node, self.hash(after)))
+        # Going through plain dicts, as over the wire, so the hashes get checked again.
+        return self.load_chain({'chain': [dict(b) for b in found[1][:len(hashes)]], 'hashes': hashes})
+
+    def grow(self, blocks):
+        '''
+        Append blocks holding only a coinbase to our chain.
+        '''
+        for _ in range(blocks):
+            last_block = self.chain[-1]
+            proof = ProofChecker(last_block['proof'], self.hash(last_block), self.difficulty).search()
+            self.new_transaction([], [], None, coinbase=True)
+            self.new_block(proof, None)
+
+    def copy(self, address, blocks=None):
+        '''
+        A new node of the same network with the first `blocks` blocks of our chain (all of them by default).
+        '''
+        node = SyntheticNode(address, self.network)
+        node.chain = list(self.chain[:blocks])
+        node.valid_chain(node.chain)
+        return node
+
+
+def synthetic_network(peers=10, length=50, fork_depth=5, byzantine=0.0, forks=3, seed=None):
+    '''
+    The network of synthetic_chains made of SyntheticNodes: we have the trunk and every peer is ahead of us.
+    :return: <tuple> (our node, set of the addresses of the byzantine peers)
+    '''
+    rng = random.Random(seed)
+    network = {}
+    us = SyntheticNode('us', network)
+    us.genesis()
+    us.grow(length - 1)
+    branches = []
+    for f in range(forks):
+        branch = us.copy('branch%d' % f)
+        branch.grow(fork_depth + 1)
+        branches.append(branch)
+    attack = us.copy('attack', rng.randint(1, length))
+    attack.grow(length + fork_depth + 2 - len(attack.chain))
+    byzantine_peers = set('peer%d' % p for p in rng.sample(range(peers), int(round(peers * byzantine))))
+    for p in range(peers):
+        address = 'peer%d' % p
+        if address in byzantine_peers:
+            attack.copy(address)
+        else:
+            rng.choice(branches).copy(address, length + rng.randint(1, fork_depth + 1))
+        us.nodes.add(address)
+    return us, byzantine_peers
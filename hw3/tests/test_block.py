@@ -0,0 +1,53 @@
+import sys
+sys.path.append("../")
+
+import copy
+import hashlib
+import json
+import pickle
+import pytest
+from block import Block
+from blockchain import Blockchain
+
+
+def old_hash(block):
+    return hashlib.sha256(json.dumps(block, sort_keys=True).encode()).hexdigest()
+
+
+def test_block_hash_matches_json_hash():
+    fields = {'index': 1, 'timestamp': 1.5, 'transactions': [{'hash': 'x'}], 'proof': 100, 'previous_hash': '1'}
+    block = Block(fields)
+    assert(block == fields)
+    assert(block.digest == old_hash(fields))
+    assert(Blockchain.hash(block) == old_hash(fields))
+    assert(json.loads(json.dumps(block)) == fields)
+
+
+def test_block_is_immutable():
+    block = Block({'index': 1, 'proof': 100})
+    with pytest.raises(TypeError):
+        block['proof'] = 5
+    with pytest.raises(TypeError):
+        block.update({'proof': 5})
+    assert(copy.deepcopy(block).digest == block.digest)
+    assert(pickle.loads(pickle.dumps(block)).digest == block.digest)
+
+
+def test_verify_on_load():
+    fields = {'index': 1, 'proof': 100}
+    assert(Block(fields, digest=old_hash(fields)).digest == old_hash(fields))
+    with pytest.raises(ValueError):
+        Block(fields, digest='0' * 64)
+    # Trusted hashes are taken as they are.
+    assert(Block(fields, digest='0' * 64, verify=False).digest == '0' * 64)
+
+
+def test_new_blocks_and_peer_chains_are_cached():
+    bc = Blockchain()
+    bc.genesis()
+    bc.mine()
+    assert(all(isinstance(block, Block) for block in bc.chain))
+    data = json.loads(json.dumps({'chain': bc.chain, 'hashes': [b.digest for b in bc.chain]}))
+    chain = bc.load_chain(data)
+    assert(bc.get_hash_list(chain) == bc.get_hash_list(bc.chain))
+    assert(bc.valid_chain(chain))
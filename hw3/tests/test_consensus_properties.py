@@ -0,0 +1,58 @@
+import sys
+sys.path.append("../")
+
+import random
+from blockchain import Blockchain
+from tests.synthetic import reference_consensus, synthetic_chains, synthetic_network
+
+'''
+Property checks of consensus on synthetic networks (see synthetic.py), against the original
+algorithm kept in synthetic.reference_consensus.
+'''
+
+def random_chains(seed):
+    rng = random.Random(seed)
+    return synthetic_chains(peers=rng.randint(1, 12), length=rng.randint(2, 30), fork_depth=rng.randint(0, 6),
+                            byzantine=rng.choice([0, 0.2, 0.4, 0.5, 0.6]), forks=rng.randint(1, 4), seed=seed)
+
+
+def test_same_winner_as_reference():
+    bc = Blockchain()
+    for seed in range(500):
+        chains, _ = random_chains(seed)
+        assert(bc.consensus(chains) == reference_consensus(chains))
+
+
+def test_honest_majority_wins():
+    bc = Blockchain()
+    for seed in range(200):
+        chains, byzantine = random_chains(seed)
+        if len(byzantine) >= len(chains) / 2: continue
+        winner = bc.consensus(chains)
+        assert(winner not in byzantine)
+        # The longest of the chains that extend the winning prefix.
+        assert(all(len(chains[winner]) >= len(chain) for chain in chains.values() if chain[:len(chains[winner])] == chains[winner]))
+
+
+def test_winner_length_does_not_depend_on_peer_order():
+    bc = Blockchain()
+    for seed in range(200):
+        chains, _ = random_chains(seed)
+        urls = list(chains)
+        random.Random(seed).shuffle(urls)
+        shuffled = {url: chains[url] for url in urls}
+        assert(len(chains[bc.consensus(shuffled)]) == len(chains[bc.consensus(chains)]))
+
+
+def test_resolve_conflicts_follows_consensus():
+    for seed in range(5):
+        us, byzantine = synthetic_network(peers=7, length=10, fork_depth=3, byzantine=0.4, seed=seed)
+        peers = {address: us.network[address] for address in us.nodes}
+        hash_chains = {address: peer.get_hash_list(peer.chain) for address, peer in peers.items()}
+        hash_chains[us.address] = us.get_hash_list(us.chain)
+        winner = us.consensus(hash_chains)
+        assert(us.resolve_conflicts())
+        # Ties between honest branches depend on the order peers are asked in.
+        adopted = [address for address, chain in hash_chains.items() if chain == us.get_hash_list(us.chain)]
+        assert(len(adopted) > 0 and len(hash_chains[adopted[0]]) == len(hash_chains[winner]))
+        assert(not set(adopted) & byzantine)
@@ -0,0 +1,227 @@
+import sys
+sys.path.append("../")
+
+import json
+import pytest
+import requests
+from blockchain import Blockchain
+from message import Message
+from utxo import UTXOSet
+
+
+class Recorder(object):
+    '''
+    Stands for the Messenger, keeps what would have been published.
+    '''
+    def __init__(self):
+        self.published = []
+
+    def publish_message(self, mtype, data):
+        self.published.append((mtype, json.loads(data)))
+
+
+def gossip_network():
+    origin = Blockchain()
+    origin.genesis()
+    origin.msgr = Recorder()
+    peer = Blockchain()
+    peer.chain = list(origin.chain)
+    peer.utxo_pool = UTXOSet(origin.utxo_pool.to_list())
+    peer.msgr = Recorder()
+    requests = []
+    def fetch_txs(address, hashes):
+        requests.append(hashes)
+        return origin.mempool_txs(hashes)
+    peer.fetch_txs = fetch_txs
+    peer.fetch_block_txs = lambda address, digest, positions: origin.block_txs(digest, positions)
+    return origin, peer, requests
+
+
+def inv(hashes):
+    return Message(Message.to_str('http://127.0.0.1:5000', Message.INV, json.dumps(hashes)))
+
+
+def test_new_transaction_is_announced_by_hash():
+    origin, _, _ = gossip_network()
+    origin.new_transaction([origin.utxo_pool.to_list()[0]], [{'amount': 2, 'addr': 'someone'}], origin.sk)
+    tx = origin.current_transactions[-1]
+    assert(origin.msgr.published == [(Message.INV, [tx['hash']])])
+
+
+def test_bodies_are_fetched_once_and_relayed():
+    origin, peer, requests = gossip_network()
+    origin.new_transaction([origin.utxo_pool.to_list()[0]], [{'amount': 2, 'addr': 'someone'}], origin.sk)
+    tx = origin.current_transactions[-1]
+    # The same announcement from several peers, some of it arriving after the body was fetched.
+    peer.process_messages([inv([tx['hash']]), inv([tx['hash']])])
+    peer.process_message(inv([tx['hash']]))
+    assert(requests == [[tx['hash']]])
+    assert(peer.current_transactions == [tx])
+    assert(peer.msgr.published == [(Message.INV, [tx['hash']])])
+    gossip = peer.mqueue_stats()['gossip']
+    assert(gossip['inv_received'] == 3 and gossip['inv_duplicates'] == 2 and gossip['tx_fetched'] == 1)
+
+
+def test_missing_bodies_are_asked_again():
+    origin, peer, requests = gossip_network()
+    peer.process_message(inv(['ab' * 32]))
+    peer.process_message(inv(['ab' * 32]))
+    assert(requests == [['ab' * 32], ['ab' * 32]])
+    assert(peer.current_transactions == [] and peer.msgr.published == [])
+
+
+def test_child_before_parent_is_fetched_again():
+    origin, peer, requests = gossip_network()
+    origin.new_transaction([origin.utxo_pool.to_list()[0]], [{'amount': 2, 'addr': origin.key_to_addr(origin.vk)}], origin.sk)
+    parent = origin.current_transactions[-1]
+    output = [utxo for utxo in origin.utxo_pool.to_list() if utxo['tx_hash'] == parent['hash']][0]
+    origin.new_transaction([output], [{'amount': 2, 'addr': 'someone'}], origin.sk)
+    child = origin.current_transactions[-1]
+    # The child spends an output the peer doesn't know yet, it is rejected but not forgotten for good.
+    peer.process_message(inv([child['hash']]))
+    assert(peer.current_transactions == [] and child['hash'] not in peer.seen_txs)
+    peer.process_message(inv([parent['hash']]))
+    peer.process_message(inv([child['hash']]))
+    assert(requests == [[child['hash']], [parent['hash']], [child['hash']]])
+    assert(peer.current_transactions == [parent, child])
+
+
+def test_seen_set_is_bounded():
+    _, peer, _ = gossip_network()
+    peer.seen_size = 3
+    assert(peer.mark_seen(['a', 'b', 'c', 'd']) == ['a', 'b', 'c', 'd'])
+    assert(list(peer.seen_txs) == ['b', 'c', 'd'])
+    assert(peer.mark_seen(['a', 'd']) == ['a'])
+
+
+def mined(node):
+    node.new_transaction([node.utxo_pool.to_list()[0]], [{'amount': 2, 'addr': 'someone'}], node.sk)
+    node.msgr.published = []
+    block = node.mine()
+    mtype, data = node.msgr.published[0]
+    assert(len(node.msgr.published) == 1 and mtype == Message.MINE and data['hash'] == block.digest)
+    return block
+
+
+def block_message(node):
+    mtype, data = node.msgr.published[-1]
+    return Message(Message.to_str('http://127.0.0.1:5000', mtype, json.dumps(data)))
+
+
+def test_mined_block_is_appended_and_relayed():
+    origin, peer, _ = gossip_network()
+    block = mined(origin)
+    assert(peer.receive_block(block_message(origin)))
+    # Same UTXOs, not in the same order: the miner added the payment to its pool when it entered the
+    # mempool and the coinbase (put first in the block) when mining, the peer adds them in block order.
+    utxos = lambda node: sorted(node.utxo_pool.to_list(), key=lambda utxo: utxo['tx_hash'])
+    assert(peer.chain == origin.chain and utxos(peer) == utxos(origin))
+    assert(len(block['transactions']) == 2 and len(utxos(peer)) == 2)
+    assert(peer.msgr.published[-1][0] == Message.MINE)
+    # The copies other peers relay are dropped.
+    peer.msgr.published = []
+    assert(not peer.receive_block(block_message(origin)) and peer.msgr.published == [])
+
+
+def test_block_checked_during_resolve_is_still_appended():
+    origin, peer, _ = gossip_network()
+    mined(origin)
+    # resolve_conflicts checked origin's chain but didn't adopt it, e.g. it wasn't the consensus then.
+    assert(peer.valid_chain(origin.chain) and origin.chain[-1].digest in peer.verified_blocks)
+    assert(peer.receive_block(block_message(origin)))
+    assert(peer.chain == origin.chain and peer.msgr.published[-1][0] == Message.MINE)
+
+
+def test_block_from_the_other_side_is_ignored():
+    origin, peer, _ = gossip_network()
+    mined(origin)
+    peer.flip_node()
+    assert(not peer.receive_block(block_message(origin)))
+    assert(len(peer.chain) == 1)
+
+
+def test_missing_parent_falls_back_to_resolve():
+    origin, peer, _ = gossip_network()
+    mined(origin)
+    mined(origin)
+    resolved = []
+    peer.resolve_conflicts = lambda: resolved.append(True)
+    assert(not peer.receive_block(block_message(origin)))
+    peer.resolve_mutex.acquire()
+    assert(resolved == [True] and len(peer.chain) == 1)
+
+
+def test_compact_block_is_rebuilt_from_the_mempool():
+    origin, peer, requests = gossip_network()
+    origin.new_transaction([origin.utxo_pool.to_list()[0]], [{'amount': 2, 'addr': 'someone'}], origin.sk)
+    peer.process_message(inv([origin.current_transactions[-1]['hash']]))
+    block = mined(origin)
+    _, data = origin.msgr.published[0]
+    assert('transactions' not in data['header'] and len(data['txids'][0]) == origin.short_id_length)
+    # Only the coinbase is sent whole.
+    assert([tx for _, tx in data['prefilled']] == [tx for tx in block['transactions'] if tx['coinbase']])
+    peer.fetch_block_txs = None
+    assert(peer.receive_block(block_message(origin)))
+    assert(peer.chain == origin.chain and peer.current_transactions == [])
+
+
+def test_compact_block_fetches_missing_txs():
+    origin, peer, _ = gossip_network()
+    block = mined(origin)
+    asked = []
+    def fetch_block_txs(address, digest, positions):
+        asked.append(positions)
+        return origin.block_txs(digest, positions)
+    peer.fetch_block_txs = fetch_block_txs
+    assert(peer.receive_block(block_message(origin)))
+    assert(asked == [[i for i, tx in enumerate(block['transactions']) if not tx['coinbase']]])
+    assert(peer.chain == origin.chain)
+    assert(origin.block_txs('ab' * 32, [0]) is None)
+
+
+def test_wrong_short_id_match_falls_back_to_resolve():
+    origin, peer, _ = gossip_network()
+    mined(origin)
+    # A transaction of ours that happens to have the same short id as the one in the block.
+    tx = [dict(tx) for tx in origin.chain[-1]['transactions'] if not tx['coinbase']][0]
+    tx['outs'] = [{'amount': 2, 'addr': 'mallory'}]
+    peer.current_transactions = [tx]
+    resolved = []
+    peer.resolve_conflicts = lambda: resolved.append(True)
+    assert(not peer.receive_block(block_message(origin)))
+    peer.resolve_mutex.acquire()
+    assert(resolved == [True] and len(peer.chain) == 1)
+
+
+def test_only_fetch_failures_fall_back_to_resolve():
+    origin, peer, _ = gossip_network()
+    mined(origin)
+    resolved = []
+    peer.resolve_conflicts = lambda: resolved.append(True)
+    def unreachable(address, digest, positions):
+        raise requests.ConnectionError(address)
+    peer.fetch_block_txs = unreachable
+    assert(not peer.receive_block(block_message(origin)))
+    peer.resolve_mutex.acquire()
+    assert(resolved == [True])
+    peer.resolve_mutex.release()
+    # A bug is not mistaken for a peer that can't send the block.
+    peer.fetch_block_txs = lambda address, digest, positions: None.txs
+    with pytest.raises(AttributeError):
+        peer.receive_block(block_message(origin))
+
+
+def test_malformed_bodies_do_not_lose_the_batch():
+    origin, peer, _ = gossip_network()
+    block = mined(origin)
+    payment = [tx for tx in block['transactions'] if not tx['coinbase']][0]
+    unasked = dict(payment, hash='cd' * 32)
+    no_coinbase = {k: v for k, v in payment.items() if k != 'coinbase'}
+    peer.fetch_txs = lambda address, hashes: ['junk', None, no_coinbase, unasked, dict(payment, ins='x')]
+    peer.process_messages([inv(['ab' * 32, payment['hash']]), block_message(origin)])
+    assert(peer.chain == origin.chain and peer.current_transactions == [])
+    assert('ab' * 32 not in peer.seen_txs)
+    # Nor does a peer answering with something that isn't a list.
+    peer.fetch_txs = lambda address, hashes: {'txs': 5}
+    peer.process_messages([inv(['ef' * 32])])
+    assert('ef' * 32 not in peer.seen_txs)
@@ -0,0 +1,129 @@
+import sys
+sys.path.append("../")
+
+import hashlib
+import time
+from threading import Thread
+from blockchain import Blockchain
+from miner import ParallelMiner, MiningService
+from proof import ProofChecker
+
+
+def test_parallel_miner_finds_valid_proof():
+    miner = ParallelMiner(workers=2, chunk=1000)
+    try:
+        proof = miner.search(100, 'abc')
+        assert(Blockchain.valid_proof(100, proof, 'abc'))
+        assert(len(miner.stats) == 2)
+        assert(miner.hashrate > 0)
+        # Pool is reused for the next block.
+        next_proof = miner.search(proof, 'def')
+        assert(Blockchain.valid_proof(proof, next_proof, 'def'))
+    finally:
+        miner.stop()
+
+
+def test_proof_of_work_uses_miner():
+    bc = Blockchain()
+    bc.set_miner(ParallelMiner(workers=2, chunk=1000))
+    block = {'index': 1, 'proof': 100, 'previous_hash': '1', 'transactions': [], 'timestamp': 0}
+    try:
+        proof = bc.proof_of_work(block)
+        assert(bc.valid_proof(100, proof, bc.hash(block)))
+    finally:
+        bc.miner.stop()
+
+
+def test_proof_checker_matches_valid_proof():
+    for last_proof, last_hash in [(100, '1'), (35293, Blockchain.hash({'a': 1})), ('3-abc', 'xyz')]:
+        for difficulty in [0, 1, 2, 3]:
+            checker = ProofChecker(last_proof, last_hash, difficulty=difficulty)
+            expected = [p for p in range(3000)
+                        if hashlib.sha256(f'{last_proof}{p}{last_hash}'.encode()).hexdigest()[:difficulty] == '0' * difficulty]
+            assert([p for p in range(3000) if checker.check(p)] == expected)
+            assert(checker.search(0, 3000) == (expected[0] if expected else None))
+    checker = ProofChecker(100, '1')
+    proof = checker.search()
+    assert(Blockchain.valid_proof(100, proof, '1'))
+    assert(not any(Blockchain.valid_proof(100, p, '1') for p in range(proof)))
+
+
+def test_proof_of_work_abandons_stale_tip():
+    bc = Blockchain()
+    block = {'index': 1, 'proof': 100, 'previous_hash': '1', 'transactions': [], 'timestamp': 0}
+    assert(bc.proof_of_work(block, generation=bc.tip_generation + 1) is None)
+    assert(ProofChecker(100, '1').search(should_stop=lambda: True) is None)
+    miner = ParallelMiner(workers=2, chunk=1000)
+    try:
+        assert(miner.search(100, '1', should_stop=lambda: True, poll=0) is None)
+    finally:
+        miner.stop()
+
+
+def test_mining_service_mines_in_background():
+    bc = Blockchain()
+    bc.genesis()
+    service = MiningService(bc)
+    service.run()
+    service.start()
+    for _ in range(100):
+        if service.blocks_mined >= 2: break
+        time.sleep(0.1)
+    service.stop()
+    status = service.status()
+    assert(status['continuous'] is False)
+    assert(status['blocks_mined'] >= 2)
+    assert(len(bc.chain) >= 3)
+    assert(bc.valid_chain(bc.chain))
+
+
+def test_new_transaction_waits_for_the_mining_thread():
+    bc = Blockchain()
+    bc.genesis()
+    coinbase = bc.utxo_pool.to_list()[0]
+    added = []
+    pay = lambda: added.append(bc.new_transaction([coinbase], [{'amount': 2, 'addr': 'someone'}], bc.sk))
+    # Holding chain_mutex like new_block does while it takes the mempool.
+    with bc.chain_mutex:
+        thr = Thread(target=pay)
+        thr.start()
+        thr.join(0.2)
+        assert(added == [] and bc.current_transactions == [] and coinbase in bc.utxo_pool)
+    thr.join()
+    assert(added == [2] and len(bc.current_transactions) == 1 and coinbase not in bc.utxo_pool)
+
+
+def wait_idle(service):
+    for _ in range(100):
+        if service.jobs.empty() and not service.mining: break
+        time.sleep(0.05)
+
+
+def test_stop_before_the_job_is_picked_up():
+    bc = Blockchain()
+    bc.genesis()
+    service = MiningService(bc)
+    service.start()
+    # stop() lands after the mining thread took the job from the queue but before it started mining.
+    job = service.jobs.get()
+    service.stop()
+    service.jobs.put(job)
+    service.run()
+    wait_idle(service)
+    time.sleep(0.1)
+    assert(service.blocks_mined == 0 and len(bc.chain) == 1)
+
+
+def test_invalid_mempool_is_not_counted_as_mined():
+    bc = Blockchain()
+    bc.genesis()
+    coinbase = bc.utxo_pool.to_list()[0]
+    bc.new_transaction([coinbase], [{'amount': 2, 'addr': 'someone'}], bc.sk)
+    bc.current_transactions[-1]['sig'] = bc.current_transactions[-1]['sig'][::-1]
+    bc.transactions_per_block = 1
+    service = MiningService(bc)
+    service.run()
+    service.request_block()
+    time.sleep(0.1)
+    wait_idle(service)
+    assert(service.blocks_mined == 0 and len(bc.chain) == 1)
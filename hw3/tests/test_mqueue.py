@@ -0,0 +1,80 @@
+import sys
+sys.path.append("../")
+
+import json
+import time
+from ecdsa import SigningKey
+from blockchain import Blockchain
+from message import Message
+from utxo import UTXOSet
+
+
+def signed_tx():
+    bc = Blockchain()
+    bc.genesis()
+    peer = Blockchain()
+    peer.chain = list(bc.chain)
+    peer.utxo_pool = UTXOSet(bc.utxo_pool.to_list())
+    bc.new_transaction([bc.utxo_pool.to_list()[0]], [{'amount': 2, 'addr': 'someone'}], bc.sk)
+    return peer, bc.current_transactions[-1], bc
+
+
+def test_consumer_processes_messages_as_they_arrive():
+    peer, tx, _ = signed_tx()
+    peer.start_consumer()
+    start = time.time()
+    peer.push_message('not a message')
+    peer.push_message(Message.to_str('127.0.0.1:5000', Message.NEW_TX, json.dumps(tx)))
+    peer.mqueue.join()
+    assert(time.time() - start < 0.5)
+    assert(peer.current_transactions == [tx])
+    stats = peer.mqueue_stats()
+    assert(stats['processed'] == 2 and stats['depth'] == 0 and stats['max_depth'] >= 1)
+    assert(0 < stats['latency_max'] < 0.5)
+
+
+def test_process_mqueue_drains_without_waiting():
+    peer, tx, _ = signed_tx()
+    peer.push_message(Message.to_str('127.0.0.1:5000', Message.NEW_TX, json.dumps(tx)))
+    peer.process_mqueue()
+    assert(peer.current_transactions == [tx] and peer.mqueue.qsize() == 0)
+    peer.process_mqueue()
+
+
+def test_batch_dedupes_and_drops_invalid():
+    peer, tx, sender = signed_tx()
+    forged = dict(tx, outs=[{'amount': 2, 'addr': 'mallory'}])
+    forged['hash'] = Blockchain.hash(forged)
+    message = lambda t: Message.to_str('127.0.0.1:5000', Message.NEW_TX, json.dumps(t))
+    for t in [tx, forged, tx, tx]:
+        peer.push_message(message(t))
+    peer.push_message(Message.to_str('127.0.0.1:5000', Message.NEW_TX, '{not json'))
+    # Copies in later batches are already in the mempool.
+    peer.mqueue_batch = 2
+    assert(len(peer.next_messages(block=False)) == 2)
+    peer.push_message(message(tx))
+    peer.process_mqueue()
+    assert(peer.current_transactions == [tx])
+    assert(peer.mqueue_stats()['processed'] == 4)
+
+    # A double spend of the same output arriving later is dropped too.
+    respend = {'ins': tx['ins'], 'outs': [{'amount': 2, 'addr': 'someone else'}], 'time': 0, 'coinbase': False}
+    respend['hash'] = Blockchain.hash(respend)
+    sender.sign_tx(respend, SigningKey.from_string(sender.sk))
+    assert(peer.verifier.verify(respend))
+    peer.push_message(message(respend))
+    peer.process_mqueue()
+    assert(peer.current_transactions == [tx])
+
+
+def test_tx_spending_an_output_twice_stays_out_of_the_mempool():
+    peer, tx, sender = signed_tx()
+    utxo = tx['ins'][0]
+    twice = {'ins': [utxo, utxo], 'outs': [{'amount': 2 * utxo['amount'], 'addr': 'mallory'}], 'time': 0, 'coinbase': False}
+    twice['hash'] = Blockchain.hash(twice)
+    sender.sign_tx(twice, SigningKey.from_string(sender.sk))
+    before = peer.utxo_pool.to_list()
+    peer.add_gossiped_txs([twice])
+    assert(peer.current_transactions == [] and peer.utxo_pool.to_list() == before)
+    peer.add_gossiped_txs([tx])
+    assert(peer.current_transactions == [tx])
@@ -0,0 +1,196 @@
+import sys
+sys.path.append("../")
+
+import time
+from ecdsa import SigningKey
+from blockchain import Blockchain
+from block import Block
+from utxo import UTXOSet
+
+
+def test_fetch_peers_in_parallel_with_deadline():
+    bc = Blockchain()
+    bc.resolve_deadline = 0.5
+    def fetch(peer):
+        if peer == 'dead':
+            raise IOError('connection refused')
+        if peer == 'slow':
+            time.sleep(2)
+        if peer == 'empty':
+            return None
+        time.sleep(0.2)
+        return peer.upper()
+    start = time.time()
+    results = bc.fetch_peers(['b', 'slow', 'a', 'dead', 'empty', 'c'], fetch)
+    assert(time.time() - start < 1)
+    assert(list(results.items()) == [('b', 'B'), ('a', 'A'), ('c', 'C')])
+
+
+def make_chain(blocks):
+    bc = Blockchain()
+    bc.genesis()
+    for _ in range(blocks):
+        bc.mine()
+    return bc
+
+
+def extend(bc, blocks, keep=None):
+    # A peer that shares the first `keep` blocks of bc's chain and mined `blocks` more.
+    peer = Blockchain()
+    peer.chain = list(bc.chain[:keep])
+    peer.valid_chain(peer.chain)
+    for _ in range(blocks):
+        peer.mine()
+    return peer
+
+
+def test_headers_after_block_locator():
+    bc = make_chain(3)
+    peer = extend(bc, 2)
+    start, headers = peer.get_headers(bc.block_locator())
+    assert(start == 4 and len(headers) == 2)
+    assert(headers[0]['previous_hash'] == bc.hash(bc.chain[-1]))
+    assert(bc.header_hash_list(bc.chain, bc.get_hash_list(bc.chain), start, headers) == peer.get_hash_list(peer.chain))
+
+    # Fork after the second block: only the forked part is sent.
+    fork = extend(bc, 3, keep=2)
+    start, headers = fork.get_headers(bc.block_locator())
+    assert(start == 2 and len(headers) == 3)
+    assert(bc.header_hash_list(bc.chain, bc.get_hash_list(bc.chain), start, headers) == fork.get_hash_list(fork.chain))
+
+    # Nothing in common: everything from genesis.
+    stranger = make_chain(1)
+    start, headers = stranger.get_headers(bc.block_locator())
+    assert(start == 0 and len(headers) == 2)
+    assert(bc.header_hash_list(bc.chain, bc.get_hash_list(bc.chain), start, headers) == stranger.get_hash_list(stranger.chain))
+
+
+def test_invalid_headers_are_rejected():
+    bc = make_chain(1)
+    peer = extend(bc, 2)
+    start, headers = peer.get_headers(bc.block_locator())
+    bad_proof = [dict(headers[0], proof=headers[0]['proof'] + 1)] + headers[1:]
+    assert(bc.header_hash_list(bc.chain, bc.get_hash_list(bc.chain), start, bad_proof) is None)
+    bad_link = headers[:1] + [dict(headers[1], previous_hash='0' * 64)]
+    assert(bc.header_hash_list(bc.chain, bc.get_hash_list(bc.chain), start, bad_link) is None)
+
+
+def test_block_locator_is_logarithmic():
+    bc = Blockchain()
+    bc.genesis()
+    bc.chain = bc.chain * 1000
+    assert(len(bc.block_locator()) < 25)
+
+
+def sync_peer(bc):
+    # A peer with the same chain and UTXO pool as bc but its own keys and mempool.
+    peer = Blockchain()
+    peer.chain = list(bc.chain)
+    peer.valid_chain(peer.chain)
+    peer.utxo_pool = UTXOSet(bc.utxo_pool.to_list())
+    return peer
+
+
+def pay(bc, utxo, sk, addr):
+    return bc.new_transaction([utxo], [{'amount': utxo['amount'], 'addr': addr}], sk)
+
+
+def test_reorganize_extends_chain():
+    bc = make_chain(0)
+    peer = sync_peer(bc)
+    peer.mine()
+    assert(bc.get_blocks(bc.hash(bc.chain[-1])) == (1, []))
+    start, blocks = peer.get_blocks(bc.hash(bc.chain[-1]))
+    assert(start == 1 and bc.reorganize(start, blocks))
+    assert(bc.chain == peer.chain)
+
+    # bc's transaction reaches the peer through gossip and the peer mines it.
+    genesis_coinbase = bc.utxo_pool.by_addr(bc.key_to_addr(bc.vk))[0]
+    pay(bc, genesis_coinbase, bc.sk, 'someone')
+    tx = bc.current_transactions[-1]
+    peer.current_transactions.append(tx)
+    peer.update_utxo_pool(tx)
+    peer.mine()
+    assert(bc.reorganize(2, peer.chain[-1:]))
+    assert(bc.current_transactions == [])
+    assert(sorted(map(str, bc.utxo_pool)) == sorted(map(str, peer.utxo_pool)))
+
+
+def test_reorganize_drops_conflicting_mempool_txs():
+    bc = make_chain(0)
+    peer = sync_peer(bc)
+    coinbase = bc.utxo_pool.to_list()[0]
+    pay(bc, coinbase, bc.sk, 'alice')
+    pay(peer, coinbase, bc.sk, 'bob')
+    peer.mine()
+    assert(bc.reorganize(1, peer.chain[1:]))
+    # Our payment to alice double spends the one to bob in the new block.
+    assert(bc.current_transactions == [])
+    assert(utxo_set(bc) == utxo_set(peer))
+
+
+def utxo_set(bc):
+    return sorted(map(str, bc.utxo_pool))
+
+
+def test_reorganize_rolls_back_to_fork_point():
+    bc = make_chain(0)
+    peer = sync_peer(bc)
+    coinbase = bc.utxo_pool.to_list()[0]
+    pay(bc, coinbase, bc.sk, 'alice')
+    tx = bc.current_transactions[-1]
+    bc.mine()
+    peer.mine()
+    peer.mine()
+    assert(bc.reorganize(1, peer.chain[1:]))
+    assert(bc.chain == peer.chain)
+    # The payment to alice isn't on the new chain, it goes back to the mempool.
+    assert(bc.current_transactions == [tx])
+    assert(len(bc.utxo_pool.by_addr(bc.key_to_addr(bc.vk))) == 0)
+    assert(utxo_set(bc) == sorted(map(str, [u for u in peer.utxo_pool if u != coinbase] + bc.utxo_pool.by_addr('alice'))))
+
+    # A chain with an invalid coinbase leaves everything as it was.
+    before = utxo_set(bc)
+    bad = dict(peer.chain[1])
+    bad_tx = dict(bad['transactions'][0], outs=[{'amount': 1000, 'addr': 'mallory'}])
+    bad_tx['hash'] = bc.hash(bad_tx)
+    bad['transactions'] = [bad_tx]
+    assert(not bc.reorganize(1, [Block(bad)]))
+    assert(bc.chain == peer.chain)
+    assert(utxo_set(bc) == before and bc.current_transactions == [tx])
+
+
+def test_block_needs_a_single_leading_coinbase():
+    bc = make_chain(0)
+    peer = sync_peer(bc)
+    pay(peer, peer.utxo_pool.to_list()[0], bc.sk, 'alice')
+    peer.mine()
+    block = peer.chain[1]
+    coinbase, payment = block['transactions']
+    second = dict(coinbase, time=coinbase['time'] + 1)
+    second['hash'] = bc.hash(second)
+    before = utxo_set(bc)
+    for txs in ([coinbase, payment, second], [coinbase, second], [payment, coinbase], [payment]):
+        assert(not bc.reorganize(1, [Block(dict(block, transactions=txs))]))
+        assert(utxo_set(bc) == before and len(bc.chain) == 1)
+    assert(bc.reorganize(1, [block]))
+
+
+def test_block_spending_an_output_twice_is_rejected():
+    bc = make_chain(0)
+    peer = sync_peer(bc)
+    peer.mine()
+    block = peer.chain[1]
+    utxo = bc.utxo_pool.to_list()[0]
+    tx = {'ins': [utxo, utxo], 'outs': [{'amount': 2 * utxo['amount'], 'addr': 'mallory'}], 'time': 0, 'coinbase': False}
+    tx['hash'] = bc.hash(tx)
+    bc.sign_tx(tx, SigningKey.from_string(bc.sk))
+    assert(bc.verify_signature(tx) and bc.valid_tx(tx) != True)
+    before = utxo_set(bc)
+    # The pool is left as it was instead of failing half way through the block.
+    assert(not bc.reorganize(1, [Block(dict(block, transactions=block['transactions'] + [tx]))]))
+    assert(utxo_set(bc) == before and len(bc.chain) == 1)
+    malformed = dict(tx, ins=[{'tx_hash': utxo['tx_hash']}])
+    assert(not bc.reorganize(1, [Block(dict(block, transactions=block['transactions'] + [malformed]))]))
+    assert(utxo_set(bc) == before and len(bc.chain) == 1)
+    assert(bc.reorganize(1, [block]))
@@ -0,0 +1,118 @@
+import sys
+sys.path.append("../")
+
+import os
+import tempfile
+from blockchain import Blockchain
+from block import Block
+from store import BlockStore, RECORD
+
+
+def utxo_set(bc):
+    return sorted(map(str, bc.utxo_pool))
+
+
+def test_append_truncate_and_reopen():
+    datadir = tempfile.mkdtemp()
+    store = BlockStore(datadir)
+    blocks = [Block({'index': i, 'proof': i, 'transactions': [], 'previous_hash': str(i)}) for i in range(5)]
+    for block in blocks:
+        store.append(block)
+    store.truncate(3)
+    store.append(blocks[4])
+    store.close()
+
+    store = BlockStore(datadir)
+    assert(store.height == 4)
+    assert(store.blocks() == blocks[:3] + blocks[4:])
+    assert([b.digest for b in store.blocks(1, 3)] == [b.digest for b in blocks[1:3]])
+    assert(store.blocks(3)[0].encoding == blocks[4].encoding)
+    store.close()
+
+    # A torn append: the last index record is cut in the middle.
+    with open(os.path.join(datadir, 'blocks.idx'), 'r+b') as f:
+        f.truncate(4 * RECORD.size - 5)
+    store = BlockStore(datadir)
+    assert(store.height == 3 and store.blocks() == blocks[:3])
+    store.append(blocks[3])
+    assert(store.blocks() == blocks[:4])
+
+
+def test_restart_from_store():
+    datadir = tempfile.mkdtemp()
+    bc = Blockchain()
+    bc.set_store(BlockStore(datadir, sync_every=2))
+    bc.genesis()
+    for _ in range(2):
+        bc.mine()
+    utxo = bc.utxo_pool.by_addr(bc.key_to_addr(bc.vk))[0]
+    bc.new_transaction([utxo], [{'amount': utxo['amount'], 'addr': 'someone'}], bc.sk)
+    bc.checkpoint()
+    bc.mine() # stored after the snapshot, replayed at startup
+    bc.store.sync()
+
+    restarted = Blockchain()
+    restarted.set_store(BlockStore(datadir))
+    assert(restarted.chain == bc.chain)
+    assert(utxo_set(restarted) == utxo_set(bc))
+    assert(restarted.current_transactions == bc.current_transactions == [])
+    assert(restarted.valid_chain(restarted.chain))
+    # Same keys, so the coinbases mined before the restart can be spent.
+    assert((restarted.sk, restarted.vk) == (bc.sk, bc.vk))
+    assert(oct(os.stat(os.path.join(datadir, 'node.key')).st_mode & 0o777) == oct(0o600))
+    mined = restarted.utxo_pool.by_addr(restarted.key_to_addr(restarted.vk))[0]
+    assert(restarted.new_transaction([mined], [{'amount': mined['amount'], 'addr': 'someone'}], restarted.sk) == len(bc.chain) + 1)
+
+    # Without a snapshot the whole chain is replayed.
+    os.remove(os.path.join(datadir, 'state.json'))
+    replayed = Blockchain()
+    replayed.set_store(BlockStore(datadir))
+    assert(replayed.chain == bc.chain and utxo_set(replayed) == utxo_set(bc))
+
+
+def test_reorganization_rewrites_store():
+    datadir = tempfile.mkdtemp()
+    bc = Blockchain()
+    bc.set_store(BlockStore(datadir))
+    bc.genesis()
+    bc.mine()
+    peer = Blockchain()
+    peer.chain = bc.chain[:1]
+    peer.valid_chain(peer.chain)
+    peer.mine()
+    peer.mine()
+    assert(bc.reorganize(1, peer.chain[1:]))
+
+    restarted = Blockchain()
+    restarted.set_store(BlockStore(datadir))
+    assert(restarted.chain == peer.chain)
+    assert(utxo_set(restarted) == utxo_set(bc))
+
+    # The mempool comes back with the snapshot.
+    utxo = bc.utxo_pool.by_addr(bc.key_to_addr(bc.vk))[0]
+    bc.new_transaction([utxo], [{'amount': utxo['amount'], 'addr': 'someone'}], bc.sk)
+    bc.checkpoint()
+    restarted = Blockchain()
+    restarted.set_store(BlockStore(datadir))
+    assert(restarted.current_transactions == bc.current_transactions)
+    assert(utxo_set(restarted) == utxo_set(bc))
+
+
+def test_raw_blocks_from_store_and_memory():
+    bc = Blockchain()
+    bc.genesis()
+    bc.mine()
+    bc.mine()
+    in_memory = bc.raw_blocks(1)
+    bc.set_store(BlockStore(tempfile.mkdtemp()))
+    assert(bc.raw_blocks(1) == in_memory)
+    encodings, hashes, length = in_memory
+    assert(length == 3 and hashes == [bc.hash(b) for b in bc.chain[1:]])
+    assert([Block.from_encoding(e) for e in encodings] == bc.chain[1:])
+
+    # The map follows the file as it grows and shrinks.
+    bc.mine()
+    assert(bc.raw_blocks(3)[1] == [bc.hash(bc.chain[3])])
+    bc.store.truncate(2)
+    bc.store.append(bc.chain[3])
+    assert(bc.store.read(2) == ([bc.chain[3].encoding], [bc.hash(bc.chain[3])]))
@@ -0,0 +1,74 @@
+import sys
+sys.path.append("../")
+
+import pytest
+from blockchain import Blockchain
+from utxo import UTXOSet
+
+
+def utxo(tx_hash, ix, amount, addr):
+    return {'tx_hash': tx_hash, 'output_index': ix, 'amount': amount, 'addr': addr}
+
+
+def test_utxo_set_behaves_like_the_old_list():
+    pool = UTXOSet()
+    old = []
+    for u in [utxo('a', 0, 2, 'alice'), utxo('b', 0, 2, 'bob'), utxo('b', 1, 3, 'alice')]:
+        pool.add(u)
+        old.append(u)
+    pool.spend(utxo('a', 0, 2, 'alice'))
+    old.remove(utxo('a', 0, 2, 'alice'))
+    pool.add(utxo('c', 0, 2, 'alice'))
+    old.append(utxo('c', 0, 2, 'alice'))
+    assert(pool.to_list() == old)
+    assert(len(pool) == 3)
+    assert(utxo('b', 0, 2, 'bob') in pool)
+    # Same outpoint with different content isn't in the pool, neither is garbage.
+    assert(utxo('b', 0, 5, 'bob') not in pool)
+    assert({'addr': 'bob'} not in pool)
+    assert(pool.by_addr('alice') == [utxo('b', 1, 3, 'alice'), utxo('c', 0, 2, 'alice')])
+    assert(pool.by_addr('carol') == [])
+    with pytest.raises(KeyError):
+        pool.spend(utxo('a', 0, 2, 'alice'))
+
+
+def test_transactions_update_utxo_set():
+    bc = Blockchain()
+    bc.genesis()
+    sk, vk = bc.generate_keypair()
+    coinbase = bc.utxo_pool.to_list()[0]
+    out = {'amount': 2, 'addr': bc.key_to_addr(vk)}
+    assert(bc.new_transaction([coinbase], [out], bc.sk) == 2)
+    assert(coinbase not in bc.utxo_pool)
+    assert(len(bc.utxo_pool.by_addr(bc.key_to_addr(vk))) == 1)
+    # Spending it twice is refused.
+    assert(bc.new_transaction([coinbase], [out], bc.sk) != 2)
+
+
+def test_address_index_and_balance():
+    pool = UTXOSet([utxo('a', 0, 2, 'alice'), utxo('b', 0, 2, 'bob'), utxo('b', 1, 3, 'alice')])
+    assert(pool.balance('alice') == 5)
+    assert(pool.count('alice') == 2)
+    assert(pool.by_addr('alice', offset=1, limit=5) == [utxo('b', 1, 3, 'alice')])
+    assert(pool.by_addr('alice', limit=1) == [utxo('a', 0, 2, 'alice')])
+    pool.spend(utxo('b', 0, 2, 'bob'))
+    assert(pool.balance('bob') == 0 and pool.count('bob') == 0)
+    # Re-adding an outpoint replaces it rather than counting it twice.
+    pool.add(utxo('a', 0, 4, 'alice'))
+    assert(pool.balance('alice') == 7)
+
+
+def test_cursor_pages():
+    pool = UTXOSet([utxo(str(i), 0, 1, 'alice') for i in range(200)])
+    first, cursor = pool.page(limit=3)
+    assert(first == [utxo('0', 0, 1, 'alice'), utxo('1', 0, 1, 'alice'), utxo('2', 0, 1, 'alice')])
+    # Spending (and compacting) under a cursor doesn't move it.
+    for i in range(150):
+        pool.spend(utxo(str(i), 0, 1, 'alice'))
+    pool.add(utxo('new', 0, 1, 'bob'))
+    pages = []
+    while cursor is not None:
+        page, cursor = pool.page(cursor, limit=7)
+        pages += page
+    assert(pages == pool.to_list())
+    assert(pool.page(limit=1000) == (pool.to_list(), None))
@@ -0,0 +1,48 @@
+import sys
+sys.path.append("../")
+
+from block import Block
+from blockchain import Blockchain
+
+
+def counting_valid_proof(bc):
+    calls = []
+    def valid_proof(last_proof, proof, last_hash):
+        calls.append(proof)
+        return Blockchain.valid_proof(last_proof, proof, last_hash)
+    bc.valid_proof = valid_proof
+    return calls
+
+
+def test_valid_chain_starts_at_fork_point():
+    bc = Blockchain()
+    bc.genesis()
+    for _ in range(3):
+        bc.mine()
+    calls = counting_valid_proof(bc)
+    assert(bc.verified_prefix(bc.chain) == 4)
+    assert(bc.valid_chain(list(bc.chain)))
+    assert(calls == [])
+
+    # A peer that mined two more blocks on top of our chain.
+    peer = Blockchain()
+    peer.chain = list(bc.chain)
+    peer.mine()
+    peer.mine()
+    assert(bc.valid_chain(peer.chain))
+    assert(len(calls) == 2)
+    # Now those are known too.
+    assert(bc.valid_chain(peer.chain))
+    assert(len(calls) == 2)
+
+
+def test_tampered_block_after_prefix_is_rejected():
+    bc = Blockchain()
+    bc.genesis()
+    bc.mine()
+    bc.mine()
+    tampered = dict(bc.chain[2])
+    tampered['proof'] += 1
+    assert(not bc.valid_chain(bc.chain[:2] + [Block(tampered)]))
+    # Verified blocks only count at their own height and when linked to their parent.
+    assert(bc.verified_prefix([bc.chain[0], bc.chain[2]]) == 1)
@@ -0,0 +1,76 @@
+import sys
+sys.path.append("../")
+
+import base58
+from blockchain import Blockchain
+from verify import KeyCache, SignatureVerifier, check_signature, key_cache
+
+
+def signed_txs(n):
+    bc = Blockchain()
+    sk, vk = bc.generate_keypair(to_str=False)
+    txs = []
+    for i in range(n):
+        tx = {'ins': [{'tx_hash': str(i), 'output_index': 0, 'amount': 1, 'addr': bc.key_to_addr(vk)}],
+              'outs': [{'amount': 1, 'addr': 'someone'}], 'time': i, 'coinbase': False}
+        tx['hash'] = bc.hash(tx)
+        txs.append(bc.sign_tx(tx, sk))
+    return txs
+
+
+def forged(tx):
+    tx = dict(tx)
+    tx['hash'] = Blockchain.hash({'other': tx['hash']})
+    return tx
+
+
+def test_verifier_caches_results():
+    tx = signed_txs(1)[0]
+    verifier = SignatureVerifier(cache_size=2)
+    assert(verifier.verify(tx) and verifier.verify(tx))
+    assert(verifier.stats()['hits'] == 1 and verifier.stats()['misses'] == 1)
+    assert(not verifier.verify(forged(tx)))
+    assert(not check_signature(dict(tx, sig=base58.b58encode(b'junk').decode())))
+    # Bounded: the least recently used entry goes first.
+    verifier.verify(signed_txs(1)[0])
+    assert(verifier.stats()['size'] == 2)
+
+
+def test_verify_many_in_pool():
+    txs = signed_txs(10)
+    txs[3] = forged(txs[3])
+    verifier = SignatureVerifier(workers=2, min_batch=4)
+    try:
+        expected = [i != 3 for i in range(10)]
+        assert(verifier.verify_many(txs) == expected)
+        assert(verifier.verify_many(txs) == expected)
+        assert(verifier.stats()['hits'] == 10)
+    finally:
+        verifier.stop()
+
+
+def test_key_cache_is_bounded_and_reused():
+    cache = KeyCache(size=2, hot_after=2)
+    addrs = [Blockchain.key_to_addr(Blockchain.generate_keypair()[1]) for _ in range(3)]
+    vk = cache.get(addrs[0])
+    assert(cache.get(addrs[0]) is vk)
+    assert(vk.to_string() == base58.b58decode(addrs[0]))
+    cache.get(addrs[1])
+    cache.get(addrs[2])
+    assert(len(cache) == 2)
+    assert(cache.get(addrs[0]) is not vk)
+    tx = signed_txs(1)[0]
+    for _ in range(3):
+        assert(check_signature(tx))
+
+
+def test_precomputed_key_still_verifies():
+    # check_signature goes through the global key_cache, the key gets precomputed on its hot_after-th use.
+    txs = signed_txs(key_cache.hot_after + 2)
+    addr = txs[0]['ins'][0]['addr']
+    for tx in txs:
+        assert(check_signature(tx))
+        assert(not check_signature(forged(tx)))
+    vk = key_cache.get(addr)
+    assert(vk.pubkey.point.order() == vk.curve.order)
+    assert(check_signature(txs[0]) and not check_signature(forged(txs[0])))
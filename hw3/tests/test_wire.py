@@ -0,0 +1,40 @@
+import sys
+sys.path.append("../")
+
+import json
+import os
+import base58
+import pytest
+import wire
+from blockchain import Blockchain
+
+
+def test_base58_matches_library():
+    for raw in [b'', b'\0', b'\0\0abc', os.urandom(64), b'\0' + os.urandom(33)]:
+        s = base58.b58encode(raw).decode()
+        assert(wire.b58encode(raw) == s)
+        assert(wire.b58decode(s) == raw)
+
+
+def test_round_trip_keeps_block_hashes():
+    bc = Blockchain()
+    bc.genesis()
+    coinbase = bc.utxo_pool.to_list()[0]
+    bc.new_transaction([coinbase], [{'amount': 2, 'addr': 'someone'}], bc.sk)
+    bc.mine()
+    data = wire.dumps({'chain': bc.chain, 'hashes': [bc.hash(b) for b in bc.chain]})
+    decoded = wire.loads(data)
+    assert(decoded['chain'] == bc.chain)
+    assert([bc.hash(b) for b in decoded['chain']] == decoded['hashes'])
+    assert(len(data) < 0.6 * len(json.dumps({'chain': bc.chain, 'hashes': decoded['hashes']})))
+
+
+def test_any_json_value():
+    value = {'x': [None, True, False, 0, -1, 2 ** 70, -2 ** 70, 0.1, 1e300, ''],
+             'unicode': 'goodcoin é', 'hash': 'AB' * 32, 'hex but short': 'ab' * 16,
+             'b58-ish': '1' * 40, 'proof': 35293, 'index': {}}
+    assert(wire.loads(wire.dumps(value)) == value)
+    with pytest.raises(ValueError):
+        wire.loads(b'\x02' + wire.dumps(value)[1:])
+    with pytest.raises(ValueError):
+        wire.loads(wire.dumps(value) + b'\0')
@@ -0,0 +1,121 @@
+from bisect import bisect_right
+from collections import defaultdict
+from itertools import islice
+
+
+class UTXOSet(object):
+    '''
+    The UTXO pool, keyed by outpoint (tx_hash, output_index) with a secondary index by address.
+
+    Replaces the plain list of {tx_hash, output_index, amount, addr} dicts: membership checks and
+    spends are O(1) instead of scanning the whole pool, and so are per-address lookups and
+    balances. Iteration keeps the order the old list had (insertion order), so to_list() gives
+    the same /jutxo output.
+
+    Every UTXO added gets the next sequence number, which is what page() uses as a cursor. The
+    (seq, outpoint) log of the pool is kept sorted in insertion order, spent entries are blanked
+    and dropped once they make up half of it, so a page is found by bisection and costs its size.
+    '''
+
+    def __init__(self, utxos=()):
+        self._utxos = {} # outpoint -> utxo
+        self._by_addr = defaultdict(dict) # addr -> {outpoint: utxo}, in insertion order
+        self._balances = defaultdict(int) # addr -> sum of the amounts it owns
+        self._seqs = [] # sequence numbers of the log, increasing
+        self._log = [] # outpoint added with each of them, None once spent
+        self._log_pos = {} # outpoint -> its position in the log
+        self._next_seq = 0
+        for utxo in utxos:
+            self.add(utxo)
+
+    @staticmethod
+    def outpoint(utxo):
+        return (utxo['tx_hash'], utxo['output_index'])
+
+    def add(self, utxo):
+        key = self.outpoint(utxo)
+        if key in self._utxos:
+            self.spend(self._utxos[key])
+        self._utxos[key] = utxo
+        self._by_addr[utxo['addr']][key] = utxo
+        self._balances[utxo['addr']] += utxo['amount']
+        self._log_pos[key] = len(self._log)
+        self._seqs.append(self._next_seq)
+        self._log.append(key)
+        self._next_seq += 1
+
+    def spend(self, utxo):
+        '''
+        Remove a UTXO from the pool.
+        :raises KeyError: if it isn't in the pool.
+        '''
+        key = self.outpoint(utxo)
+        spent = self._utxos.pop(key)
+        owned = self._by_addr[spent['addr']]
+        del owned[key]
+        self._balances[spent['addr']] -= spent['amount']
+        if not owned:
+            del self._by_addr[spent['addr']]
+            del self._balances[spent['addr']]
+        self._log[self._log_pos.pop(key)] = None
+        if len(self._log) > 64 and len(self._log_pos) < len(self._log) / 2:
+            self._compact()
+        return spent
+
+    def _compact(self):
+        live = [i for i, key in enumerate(self._log) if key is not None]
+        self._seqs = [self._seqs[i] for i in live]
+        self._log = [self._log[i] for i in live]
+        self._log_pos = {key: i for i, key in enumerate(self._log)}
+
+    def page(self, cursor=None, limit=100):
+        '''
+        UTXOs in insertion order, limit at a time.
+        :param cursor: <int> (Optional) Cursor returned with the previous page, None for the first one.
+        :return: <tuple> (list of UTXOs, cursor of the next page or None if this was the last one)
+        '''
+        position = 0 if cursor is None else bisect_right(self._seqs, cursor)
+        utxos = []
+        while position < len(self._log) and len(utxos) < limit:
+            key = self._log[position]
+            if key is not None:
+                utxos.append(self._utxos[key])
+            position += 1
+        if position >= len(self._log):
+            return utxos, None
+        return utxos, self._seqs[position - 1]
+
+    def get(self, tx_hash, output_index):
+        return self._utxos.get((tx_hash, output_index))
+
+    def by_addr(self, addr, offset=0, limit=None):
+        '''
+        UTXOs owned by addr, oldest first.
+        :param offset: <int> Number of UTXOs to skip.
+        :param limit: <int> (Optional) Maximum number of UTXOs returned.
+        '''
+        owned = self._by_addr.get(addr, {})
+        stop = None if limit is None else offset + limit
+        return list(islice(owned.values(), offset, stop))
+
+    def count(self, addr):
+        return len(self._by_addr.get(addr, {}))
+
+    def balance(self, addr):
+        return self._balances.get(addr, 0)
+
+    def __contains__(self, utxo):
+        # Same answer as `utxo in list_of_utxos`: the outpoint must be unspent and every field must match.
+        try:
+            return self._utxos.get(self.outpoint(utxo)) == utxo
+        except (KeyError, TypeError):
+            return False
+
+    def __iter__(self):
+        return iter(list(self._utxos.values()))
+
+    def __len__(self):
+        return len(self._utxos)
+
+    def to_list(self):
+        return list(self._utxos.values())
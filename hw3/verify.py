@@ -0,0 +1,186 @@
+'''
+Transaction signature verification for the GoodCoin.
+
+The same transaction gets verified several times on a node: in new_transaction, again for every
+transaction of new_block and again when it arrives through gossip. SignatureVerifier remembers
+results in a bounded LRU cache and can check the transactions of a whole block in a process pool.
+
+Decoding an address into a VerifyingKey is not free either and the same few addresses keep coming
+back, so decoded keys are kept in a KeyCache as well.
+'''
+import logging
+import multiprocessing
+import base58
+from collections import OrderedDict
+from ecdsa import VerifyingKey, BadSignatureError
+from ecdsa.ellipticcurve import PointJacobi
+from threading import Lock
+
+logging.basicConfig(level=logging.INFO)
+
+
+class KeyCache(object):
+    '''
+    Bounded LRU cache of decoded verifying keys by address.
+    Keys used at least hot_after times also get their multiplication tables precomputed,
+    which costs about as much as 256 verifications but makes every later one about twice as fast.
+    '''
+
+    def __init__(self, size=1024, hot_after=8):
+        self.size = size
+        self.hot_after = hot_after
+        self._keys = OrderedDict() # addr -> [vk, uses], least recently used first
+        self._mutex = Lock()
+
+    def get(self, addr):
+        with self._mutex:
+            entry = self._keys.get(addr)
+            if entry is not None:
+                self._keys.move_to_end(addr)
+        if entry is None:
+            entry = [VerifyingKey.from_string(base58.b58decode(bytes(addr, 'utf-8'))), 0]
+            with self._mutex:
+                entry = self._keys.setdefault(addr, entry)
+                while len(self._keys) > self.size:
+                    self._keys.popitem(last=False)
+        with self._mutex:
+            entry[1] += 1
+            hot = entry[1] == self.hot_after
+        if hot:
+            self.precompute(entry[0])
+        return entry[0]
+
+    @staticmethod
+    def precompute(vk):
+        # VerifyingKey.precompute() needs the point to know the curve order, which from_string leaves out.
+        point = vk.pubkey.point
+        vk.pubkey.point = PointJacobi(point.curve(), point.x(), point.y(), 1, vk.curve.order, generator=True)
+        vk.pubkey.point * 2 # builds the tables now rather than during the next verification
+
+    def clear(self):
+        with self._mutex:
+            self._keys.clear()
+
+    def __len__(self):
+        return len(self._keys)
+
+
+key_cache = KeyCache()
+
+
+def addr_to_vk(addr):
+    '''
+    Convert an address back into a verifying key format so you can verify a signature.
+    '''
+    return key_cache.get(addr)
+
+
+def check_signature(tx):
+    '''
+    Check that the transaction signature is valid using the public key from tranaction inputs.
+    return True for valid signature else False
+    '''
+    if tx['coinbase'] == True: return True
+    try:
+        sig = base58.b58decode(bytes(tx['sig'], 'utf-8'))
+        vk = addr_to_vk(tx['ins'][0]['addr']) # again, assume all input addresses are the same.
+        return vk.verify(sig, bytes(tx['hash'], 'utf-8'))
+    except (BadSignatureError, KeyError, IndexError, ValueError, AssertionError) as e:
+        logging.debug("Bad signature on %s: %s" % (tx.get('hash'), e))
+        return False
+
+
+class SignatureVerifier(object):
+
+    def __init__(self, cache_size=10000, workers=0, min_batch=8):
+        '''
+        :param cache_size: <int> Maximum number of results kept.
+        :param workers: <int> Size of the process pool used by verify_many, 0 verifies in this process.
+        :param min_batch: <int> verify_many only goes to the pool for at least this many uncached transactions.
+        '''
+        self.cache_size = cache_size
+        self.workers = workers
+        self.min_batch = min_batch
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict() # (tx hash, sig, addr) -> bool, least recently used first
+        self._mutex = Lock()
+        self._pool = None
+
+    @staticmethod
+    def key(tx):
+        # The signing address is part of the key: the same hash and sig under another address is another check.
+        addr = tx['ins'][0]['addr'] if tx.get('ins') else None
+        return (tx.get('hash'), tx.get('sig'), addr)
+
+    def lookup(self, key):
+        with self._mutex:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+            return None
+
+    def remember(self, key, valid):
+        with self._mutex:
+            self._cache[key] = valid
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def verify(self, tx):
+        if tx['coinbase'] == True: return True
+        key = self.key(tx)
+        valid = self.lookup(key)
+        if valid is None:
+            valid = check_signature(tx)
+            self.remember(key, valid)
+        return valid
+
+    def verify_many(self, txs):
+        '''
+        Verify a batch of transactions, e.g. all the transactions of a block.
+        Transactions not in the cache are checked together, in the process pool if there is one.
+        :return: <list> One bool per transaction.
+        '''
+        results = [None] * len(txs)
+        todo = []
+        for i, tx in enumerate(txs):
+            if tx['coinbase'] == True:
+                results[i] = True
+            else:
+                results[i] = self.lookup(self.key(tx))
+                if results[i] is None:
+                    todo.append(i)
+        if self.workers > 0 and len(todo) >= self.min_batch:
+            self.start()
+            checked = self._pool.map(check_signature, [txs[i] for i in todo])
+        else:
+            checked = [check_signature(txs[i]) for i in todo]
+        for i, valid in zip(todo, checked):
+            self.remember(self.key(txs[i]), valid)
+            results[i] = valid
+        return results
+
+    def start(self):
+        '''
+        Start the process pool now rather than on the first batch that needs it.
+        '''
+        if self.workers > 0 and self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers)
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'size': len(self._cache),
+                'capacity': self.cache_size,
+                'keys': len(key_cache)}
@@ -0,0 +1,230 @@
+'''
+Compact binary encoding of blocks and transactions for the GoodCoin.
+
+Peers exchange blocks as JSON, where hashes are 64 hex digits, keys and signatures are base58
+strings and every field name is spelled out in every transaction. This encoding carries the
+same values in a tagged binary form:
+ - hashes (64 lowercase hex digits) as their 32 raw bytes,
+ - base58 strings (addresses, signatures) as the raw bytes they encode,
+ - integers as zigzag varints, floats (timestamps) as 8 byte doubles,
+ - the field names of blocks and transactions as one byte.
+
+loads(dumps(x)) == x for any JSON value x, so a block decoded from it has the same
+Blockchain.hash as the original. It is negotiated over HTTP with the Accept header (see
+server.py wants_wire and Blockchain.decode_response): peers that don't ask for it get JSON.
+'''
+import struct
+
+MEDIA_TYPE = 'application/x-goodcoin-wire'
+VERSION = b'\x01'
+
+NULL, FALSE, TRUE, INT, FLOAT, STR, HEX32, B58, LIST, DICT = range(10)
+
+# Field names of blocks, headers, transactions and UTXOs, sent as their position here.
+KEYS = ['index', 'timestamp', 'transactions', 'proof', 'previous_hash', 'ins', 'outs', 'time',
+        'coinbase', 'hash', 'sig', 'addr', 'amount', 'tx_hash', 'output_index', 'num_txs',
+        'chain', 'blocks', 'hashes', 'headers', 'start', 'length', 'next_start']
+KEY_IDS = {key: i for i, key in enumerate(KEYS)}
+OTHER_KEY = len(KEYS)
+
+ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+ALPHABET_SET = frozenset(ALPHABET)
+DIGIT = {c: i for i, c in enumerate(ALPHABET)}
+# base58 is converted two digits at a time, it halves the big integer operations.
+PAIRS = [a + b for a in ALPHABET for b in ALPHABET]
+PAIR_VALUE = {pair: i for i, pair in enumerate(PAIRS)}
+
+DOUBLE = struct.Struct('>d')
+
+# The same few addresses are in most transactions, their conversions are remembered.
+# Signatures are all different and are converted every time.
+B58_CACHE_SIZE = 4096
+_b58_raw = {} # str -> raw bytes
+_b58_str = {} # raw bytes -> str
+
+
+def b58encode(raw):
+    '''
+    Same result as base58.b58encode(raw).decode(), about 3 times faster for 64 byte keys and signatures.
+    '''
+    zeros = len(raw) - len(raw.lstrip(b'\0'))
+    n = int.from_bytes(raw, 'big')
+    pairs = []
+    while n:
+        n, pair = divmod(n, 58 * 58)
+        pairs.append(PAIRS[pair])
+    return '1' * zeros + ''.join(reversed(pairs)).lstrip('1')
+
+
+def b58decode(s):
+    '''
+    Same result as base58.b58decode(s) for a string of the base58 alphabet.
+    '''
+    stripped = s.lstrip('1')
+    odd = len(stripped) % 2
+    n = DIGIT[stripped[0]] if odd else 0
+    for i in range(odd, len(stripped), 2):
+        n = n * (58 * 58) + PAIR_VALUE[stripped[i:i + 2]]
+    return b'\0' * (len(s) - len(stripped)) + n.to_bytes((n.bit_length() + 7) // 8, 'big')
+
+
+def varint(n):
+    out = bytearray()
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def dumps(value):
+    '''
+    :param value: JSON value, e.g. a Block, a transaction or a whole /jchain response.
+    :return: <bytes>
+    '''
+    out = bytearray(VERSION)
+    _encode(value, out)
+    return bytes(out)
+
+
+def _encode(value, out):
+    if value is None:
+        out.append(NULL)
+    elif value is True:
+        out.append(TRUE)
+    elif value is False:
+        out.append(FALSE)
+    elif isinstance(value, int):
+        out.append(INT)
+        out += varint(value * 2 if value >= 0 else -value * 2 - 1)
+    elif isinstance(value, float):
+        out.append(FLOAT)
+        out += DOUBLE.pack(value)
+    elif isinstance(value, str):
+        _encode_str(value, out)
+    elif isinstance(value, (list, tuple)):
+        out.append(LIST)
+        out += varint(len(value))
+        for item in value:
+            _encode(item, out)
+    elif isinstance(value, dict):
+        out.append(DICT)
+        out += varint(len(value))
+        for key, item in value.items():
+            key_id = KEY_IDS.get(key)
+            if key_id is None:
+                out += varint(OTHER_KEY)
+                key = key.encode()
+                out += varint(len(key))
+                out += key
+            else:
+                out += varint(key_id)
+            _encode(item, out)
+    else:
+        raise TypeError('Cannot encode %s' % type(value).__name__)
+
+
+def _encode_str(value, out):
+    if len(value) == 64:
+        try:
+            raw = bytes.fromhex(value)
+            if raw.hex() == value:
+                out.append(HEX32)
+                out += raw
+                return
+        except ValueError:
+            pass
+    if len(value) >= 32 and ALPHABET_SET.issuperset(value):
+        raw = _b58_raw.get(value)
+        if raw is None:
+            raw = b58decode(value)
+            _remember(_b58_raw, value, raw)
+        out.append(B58)
+        out += varint(len(raw))
+        out += raw
+        return
+    raw = value.encode()
+    out.append(STR)
+    out += varint(len(raw))
+    out += raw
+
+
+def _remember(cache, key, value):
+    if len(cache) >= B58_CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
+
+
+def loads(data):
+    '''
+    :param data: <bytes> Output of dumps.
+    :return: The value that was encoded.
+    '''
+    data = bytes(data)
+    if data[:1] != VERSION:
+        raise ValueError('Unknown wire format version %r' % data[:1])
+    value, position = _decode(data, 1)
+    if position != len(data):
+        raise ValueError('%s trailing bytes' % (len(data) - position))
+    return value
+
+
+def _varint(data, position):
+    n, shift = 0, 0
+    while True:
+        byte = data[position]
+        position += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, position
+        shift += 7
+
+
+def _decode(data, position):
+    tag = data[position]
+    position += 1
+    if tag == DICT:
+        count, position = _varint(data, position)
+        value = {}
+        for _ in range(count):
+            key_id, position = _varint(data, position)
+            if key_id == OTHER_KEY:
+                length, position = _varint(data, position)
+                key = data[position:position + length].decode()
+                position += length
+            else:
+                key = KEYS[key_id]
+            value[key], position = _decode(data, position)
+        return value, position
+    if tag == HEX32:
+        return data[position:position + 32].hex(), position + 32
+    if tag == INT:
+        n, position = _varint(data, position)
+        return (n >> 1 if n & 1 == 0 else -(n >> 1) - 1), position
+    if tag == B58:
+        length, position = _varint(data, position)
+        raw = data[position:position + length]
+        value = _b58_str.get(raw)
+        if value is None:
+            value = b58encode(raw)
+            _remember(_b58_str, raw, value)
+        return value, position + length
+    if tag == LIST:
+        count, position = _varint(data, position)
+        value = []
+        for _ in range(count):
+            item, position = _decode(data, position)
+            value.append(item)
+        return value, position
+    if tag == FLOAT:
+        return DOUBLE.unpack_from(data, position)[0], position + 8
+    if tag == STR:
+        length, position = _varint(data, position)
+        return data[position:position + length].decode(), position + length
+    if tag == TRUE:
+        return True, position
+    if tag == FALSE:
+        return False, position
+    if tag == NULL:
+        return None, position
+    raise ValueError('Unknown wire tag %s at %s' % (tag, position - 1))